@@ -0,0 +1,148 @@
+"""
+Gzip export files of each chat, built by Celery and served by nginx.
+
+New logs are appended as new gzip members (a gzip file may have many members),
+edits and deletions rebuild the files. The JSON file ends with a member which
+only contains "]", it is cut off before appending.
+"""
+import csv
+import gzip
+import json
+import os
+import shutil
+from itertools import islice
+from typing import Optional, List
+
+from django.conf import settings
+
+from .export import query_values, csv_row, json_item, json_encoder, CSV_HEADER, Echo
+from .log_values import EXPORT_CHUNK_SIZE
+
+EXPORT_FORMATS = ('csv', 'json', 'ndjson')
+# rebuild when too many small members appended
+MAX_MEMBERS = 256
+
+
+def artifact_dir(chat_id) -> str:
+    return os.path.join(settings.EXPORT_ROOT, str(chat_id))
+
+
+def artifact_name(method: str) -> str:
+    return 'log.{}.gz'.format(method)
+
+
+def artifact_path(chat_id, method: str) -> str:
+    return os.path.join(artifact_dir(chat_id), artifact_name(method))
+
+
+def manifest_path(chat_id) -> str:
+    return os.path.join(artifact_dir(chat_id), 'manifest.json')
+
+
+def load_manifest(chat_id) -> Optional[dict]:
+    try:
+        with open(manifest_path(chat_id)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def temp_path(path: str) -> str:
+    return '{}.{}.tmp'.format(path, os.getpid())
+
+
+def save_manifest(chat_id, manifest: dict):
+    path = manifest_path(chat_id)
+    with open(temp_path(path), 'w') as f:
+        json.dump(manifest, f)
+    os.replace(temp_path(path), path)
+
+
+def encode(method: str, logs: List[dict], count: int) -> bytes:
+    """
+    Encode logs to append after `count` logs.
+    """
+    if method == 'csv':
+        writer = csv.writer(Echo())
+        text = ''.join(csv_row(writer, log) for log in logs)
+    elif method == 'json':
+        items = [json_encoder.encode(json_item(log)) for log in logs]
+        text = (',' if count else '') + ','.join(items)
+    else:
+        text = ''.join(json_encoder.encode(json_item(log)) + '\n' for log in logs)
+    return text.encode()
+
+
+def write_member(f, data: bytes):
+    with gzip.GzipFile(fileobj=f, mode='wb') as member:
+        member.write(data)
+
+
+def build(chat) -> dict:
+    """
+    Write all export files of the chat from scratch.
+    """
+    os.makedirs(artifact_dir(chat.id), exist_ok=True)
+    files = {method: open(temp_path(artifact_path(chat.id, method)), 'wb') for method in EXPORT_FORMATS}
+    try:
+        members = {method: gzip.GzipFile(fileobj=f, mode='wb') for method, f in files.items()}
+        members['csv'].write(csv.writer(Echo()).writerow(CSV_HEADER).encode())
+        members['json'].write(b'[')
+        count = 0
+        last_id = 0
+        logs = query_values(chat)
+        while True:
+            batch = list(islice(logs, EXPORT_CHUNK_SIZE))
+            if not batch:
+                break
+            for method, member in members.items():
+                member.write(encode(method, batch, count))
+            count += len(batch)
+            last_id = max(last_id, max(log['id'] for log in batch))
+        for member in members.values():
+            member.close()
+        json_tail = files['json'].tell()
+        write_member(files['json'], b']')
+    finally:
+        for f in files.values():
+            f.close()
+    for method in EXPORT_FORMATS:
+        path = artifact_path(chat.id, method)
+        os.replace(temp_path(path), path)
+    manifest = dict(last_id=last_id, count=count, json_tail=json_tail, members=1)
+    save_manifest(chat.id, manifest)
+    return manifest
+
+
+def append(chat) -> dict:
+    """
+    Append the logs created after the last build or append.
+    """
+    manifest = load_manifest(chat.id)
+    if manifest is None or manifest['members'] >= MAX_MEMBERS:
+        return build(chat)
+    logs = list(query_values(chat, after_id=manifest['last_id']))
+    if not logs:
+        return manifest
+    json_tail = manifest['json_tail']
+    for method in EXPORT_FORMATS:
+        path = artifact_path(chat.id, method)
+        # copy, then the file being downloaded is never changed
+        shutil.copyfile(path, temp_path(path))
+        with open(temp_path(path), 'r+b') as f:
+            if method == 'json':
+                f.truncate(manifest['json_tail'])
+            f.seek(0, os.SEEK_END)
+            write_member(f, encode(method, logs, manifest['count']))
+            if method == 'json':
+                json_tail = f.tell()
+                write_member(f, b']')
+        os.replace(temp_path(path), path)
+    manifest = dict(
+        last_id=max(manifest['last_id'], max(log['id'] for log in logs)),
+        count=manifest['count'] + len(logs),
+        json_tail=json_tail,
+        members=manifest['members'] + 1,
+    )
+    save_manifest(chat.id, manifest)
+    return manifest
@@ -0,0 +1,151 @@
+"""
+Parquet export, entities are flattened into typed columns for analysis.
+"""
+from itertools import islice
+from typing import Iterator, List
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    # optional, only needed by the parquet export
+    pyarrow = None
+
+from .log_values import KIND_NAMES, LOG_FIELDS, media_url, EXPORT_CHUNK_SIZE
+
+ROW_GROUP_SIZE = EXPORT_CHUNK_SIZE
+ROW_FIELDS = LOG_FIELDS + ('chat_id',)
+
+
+def schema():
+    return pyarrow.schema([
+        ('chat_id', pyarrow.int64()),
+        ('message_id', pyarrow.int64()),
+        ('user_fullname', pyarrow.string()),
+        ('character_name', pyarrow.string()),
+        ('type', pyarrow.string()),
+        ('content', pyarrow.string()),
+        ('media', pyarrow.string()),
+        ('is_gm', pyarrow.bool_()),
+        ('created', pyarrow.timestamp('us')),
+        ('reply_to', pyarrow.int64()),
+        # text of the text entities, without rolls
+        ('text', pyarrow.string()),
+        ('text_length', pyarrow.int32()),
+        ('mentioned_characters', pyarrow.list_(pyarrow.string())),
+        ('roll_expressions', pyarrow.list_(pyarrow.string())),
+        ('roll_results', pyarrow.list_(pyarrow.int64())),
+        ('coc_rolled', pyarrow.int32()),
+        ('coc_level', pyarrow.string()),
+        ('coc_modifier', pyarrow.string()),
+        ('coc_rolled_list', pyarrow.list_(pyarrow.int32())),
+        ('loop_rolled', pyarrow.list_(pyarrow.int32())),
+        ('loop_successes', pyarrow.int32()),
+    ])
+
+
+def flatten(log: dict) -> dict:
+    text = ''
+    row = dict(
+        chat_id=log['chat_id'],
+        message_id=log['message_id'],
+        user_fullname=log['user_fullname'],
+        character_name=log['character_name'],
+        type=KIND_NAMES.get(log['kind']),
+        content=log['content'],
+        media=media_url(log['media']),
+        is_gm=log['gm'],
+        created=log['created'],
+        reply_to=log['reply__message_id'],
+        mentioned_characters=[],
+        roll_expressions=[],
+        roll_results=[],
+        coc_rolled=None,
+        coc_level=None,
+        coc_modifier=None,
+        coc_rolled_list=None,
+        loop_rolled=None,
+        loop_successes=None,
+    )
+    for entity in log['entities']:
+        kind = entity.get('kind')
+        if kind == 'span' or kind == 'bold' or kind == 'code':
+            text += entity['value']
+        elif kind == 'character' or kind == 'me':
+            text += entity['value']
+            row['mentioned_characters'].append(entity['value'])
+        elif kind == 'roll':
+            row['roll_expressions'].append(entity['value'])
+            row['roll_results'].append(entity.get('result'))
+        elif kind == 'coc-roll':
+            row['coc_rolled'] = entity['rolled']
+            row['coc_level'] = entity['level']
+            row['coc_modifier'] = entity['modifier_name']
+            row['coc_rolled_list'] = entity['rolled_list']
+        elif kind == 'loop-roll':
+            row['loop_rolled'] = entity['rolled']
+            row['loop_successes'] = entity['rolled'].count(6)
+    row['text'] = text
+    row['text_length'] = len(text)
+    return row
+
+
+class ChunkSink:
+    """
+    A write-only file which keeps written bytes until taken, for streaming the parquet file.
+    """
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def write_row_groups(logs: Iterator[dict], where) -> Iterator[int]:
+    """
+    Write logs (dicts of `ROW_FIELDS`) to a parquet file, one row group per chunk,
+    so only a chunk is in memory. Yields the count of rows after each row group.
+    """
+    table_schema = schema()
+    count = 0
+    with pyarrow.parquet.ParquetWriter(where, table_schema, compression='zstd') as writer:
+        while True:
+            batch = [flatten(log) for log in islice(logs, ROW_GROUP_SIZE)]
+            if not batch:
+                break
+            writer.write_table(pyarrow.Table.from_pylist(batch, schema=table_schema))
+            count += len(batch)
+            yield count
+    # the footer
+    yield count
+
+
+def query_rows(log_set):
+    return log_set.select_related(None).prefetch_related(None).values(*ROW_FIELDS).iterator(chunk_size=ROW_GROUP_SIZE)
+
+
+def parquet_export(current):
+    sink = ChunkSink()
+    for _ in write_row_groups(query_rows(current.query_log()), pyarrow.PythonFile(sink, mode='w')):
+        data = sink.take()
+        if data:
+            yield data
@@ -1,58 +1,98 @@
 import csv
 
-from django.http import HttpResponse, JsonResponse
-
-
-def csv_export(filename, current):
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="{}.csv"'.format(filename)
-
-    writer = csv.writer(response)
-    writer.writerow((
-        'Message ID',
-        'User Fullname',
-        'Character Name',
-        'Type',
-        'Content',
-        'Media',
-        'Is GM',
-        'Date',
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .columnar import pyarrow, parquet_export
+from .log_values import EXPORT_CHUNK_SIZE, KIND_NAMES, LOG_FIELDS, media_url
+
+
+def query_values(current, after_id=None):
+    # plain dicts instead of model instances, fetched chunk by chunk
+    queryset = current.query_log().select_related(None).prefetch_related(None)
+    if after_id is not None:
+        queryset = queryset.filter(id__gt=after_id)
+    return queryset.values(*LOG_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+class Echo:
+    """
+    A file-like object which returns what written, for csv.writer.
+    """
+    def write(self, value):
+        return value
+
+
+CSV_HEADER = (
+    'Message ID',
+    'User Fullname',
+    'Character Name',
+    'Type',
+    'Content',
+    'Media',
+    'Is GM',
+    'Date',
+)
+
+
+def csv_row(writer, log: dict) -> str:
+    return writer.writerow((
+        str(log['message_id']),
+        log['user_fullname'],
+        log['character_name'],
+        KIND_NAMES.get(log['kind']),
+        log['content'],
+        media_url(log['media']),
+        str(log['gm']),
+        log['created'].strftime('%y-%m-%d %H:%M:%S'),
     ))
-    for log in current.query_log():
-        writer.writerow((
-            str(log.message_id),
-            log.user_fullname,
-            log.character_name,
-            log.get_kind_display(),
-            log.content,
-            log.media_url(),
-            str(log.gm),
-            log.created.strftime('%y-%m-%d %H:%M:%S'),
-        ))
-
-    return response
-
-
-def json_export(_, current):
-    export_data = []
-    for log in current.query_log():
-        export_data.append({
-            'message_id': log.message_id,
-            'user_fullname': log.user_fullname,
-            'character_name': log.character_name,
-            'type': log.get_kind_display(),
-            'entities': log.entities,
-            'media': log.media_url(),
-            'is_gm': log.gm,
-            'created': log.created,
-            'reply_to': log.reply_message_id(),
-        })
-    return JsonResponse(export_data, safe=False)
 
 
+def json_item(log: dict) -> dict:
+    return {
+        'message_id': log['message_id'],
+        'user_fullname': log['user_fullname'],
+        'character_name': log['character_name'],
+        'type': KIND_NAMES.get(log['kind']),
+        'entities': log['entities'],
+        'media': media_url(log['media']),
+        'is_gm': log['gm'],
+        'created': log['created'],
+        'reply_to': log['reply__message_id'],
+    }
+
+
+json_encoder = DjangoJSONEncoder(ensure_ascii=False)
+
+
+def csv_export(current):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for log in query_values(current):
+        yield csv_row(writer, log)
+
+
+def json_export(current):
+    yield '['
+    separator = ''
+    for log in query_values(current):
+        yield separator + json_encoder.encode(json_item(log))
+        separator = ','
+    yield ']'
+
+
+def ndjson_export(current):
+    for log in query_values(current):
+        yield json_encoder.encode(json_item(log)) + '\n'
+
+
+# method: (generate chunks of text or bytes, content type, download as attachment)
 EXPORT_METHOD = {
-    'csv': csv_export,
-    'json': json_export,
+    'csv': (csv_export, 'text/csv', True),
+    'json': (json_export, 'application/json; charset=utf-8', False),
+    'ndjson': (ndjson_export, 'application/x-ndjson; charset=utf-8', False),
 }
 
+if pyarrow is not None:
+    EXPORT_METHOD['parquet'] = (parquet_export, 'application/vnd.apache.parquet', True)
+
 __ALL__ = ['EXPORT_METHOD']
@@ -0,0 +1,31 @@
+"""
+Log rows as plain dicts, shared by the export formats.
+"""
+from django.core.files.storage import default_storage
+
+from .models import LogKind
+
+EXPORT_CHUNK_SIZE = 2000
+
+KIND_NAMES = {kind.value: kind.name for kind in LogKind}
+
+LOG_FIELDS = (
+    'id',
+    'message_id',
+    'user_fullname',
+    'character_name',
+    'kind',
+    'content',
+    'entities',
+    'media',
+    'gm',
+    'created',
+    'reply__message_id',
+)
+
+
+def media_url(name: str) -> str:
+    if name:
+        return default_storage.url(name)
+    else:
+        return ''
@@ -0,0 +1,54 @@
+import json
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from archive.models import Log
+from entities import object_to_entity, make_entities_object
+
+ENTITY_COUNT = 100000
+
+
+class Command(BaseCommand):
+    help = 'Measure time and memory of (de)serializing 100k entities from dumped Log.entities'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus', type=str, help='JSON lines of Log.entities, read from database if not set')
+        parser.add_argument('--dump', type=str, help='write Log.entities of database to this file and exit')
+
+    def handle(self, *args, **options):
+        if options['dump']:
+            with open(options['dump'], 'w', encoding='utf-8') as f:
+                for entities in Log.objects.values_list('entities', flat=True).iterator():
+                    f.write(json.dumps(entities, ensure_ascii=False) + '\n')
+            return
+
+        if options['corpus']:
+            with open(options['corpus'], encoding='utf-8') as f:
+                corpus = [obj for line in f if line.strip() for obj in json.loads(line)]
+        else:
+            corpus = [obj for entities in Log.objects.values_list('entities', flat=True).iterator() for obj in entities]
+        if not corpus:
+            self.stderr.write('Empty corpus')
+            return
+        objects = (corpus * (ENTITY_COUNT // len(corpus) + 1))[:ENTITY_COUNT]
+
+        start = time.perf_counter()
+        entities = [object_to_entity(obj) for obj in objects]
+        load_time = time.perf_counter() - start
+        del entities
+
+        tracemalloc.start()
+        entities = [object_to_entity(obj) for obj in objects]
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        make_entities_object(entities)
+        dump_time = time.perf_counter() - start
+
+        self.stdout.write('{} entities (corpus: {})'.format(len(entities), len(corpus)))
+        self.stdout.write('  from_object: {:.1f} ms'.format(load_time * 1000))
+        self.stdout.write('    to_object: {:.1f} ms'.format(dump_time * 1000))
+        self.stdout.write('       memory: {:.2f} MiB'.format(memory / 1024 / 1024))
@@ -0,0 +1,29 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from archive.columnar import pyarrow, query_rows, write_row_groups
+from archive.models import Log
+
+
+class Command(BaseCommand):
+    help = 'Export logs of all chats to a parquet file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chat', type=int, action='append', help='only export this chat, can be repeated')
+        parser.add_argument('--output', default=os.path.join(settings.EXPORT_ROOT, 'logs.parquet'))
+
+    def handle(self, *args, **options):
+        if pyarrow is None:
+            raise CommandError('pyarrow is required, try `pip install pyarrow`')
+        log_set = Log.objects.filter(deleted=False).order_by('chat_id', 'created', 'id')
+        if options['chat']:
+            log_set = log_set.filter(chat_id__in=options['chat'])
+        output = options['output']
+        temp = '{}.tmp'.format(output)
+        count = 0
+        for count in write_row_groups(query_rows(log_set), temp):
+            self.stdout.write('{} logs written'.format(count), ending='\r')
+        os.replace(temp, output)
+        self.stdout.write('{} logs exported to {}'.format(count, output))
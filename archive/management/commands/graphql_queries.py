@@ -0,0 +1,50 @@
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from schema import schema
+
+# the query of the index page
+INDEX_QUERY = '''
+query {
+  chats {
+    id
+    title
+    counter
+    players {
+      id
+      characterName
+      isGm
+    }
+  }
+}
+'''
+
+# chats, log counts and players, however many chats there are
+MAX_INDEX_QUERIES = 3
+
+
+class Command(BaseCommand):
+    help = 'Check the number of SQL queries of the index GraphQL query, fails when it is over the limit'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max', type=int, default=MAX_INDEX_QUERIES)
+        parser.add_argument('--verbose-sql', action='store_true', help='print executed SQL')
+
+    def handle(self, *args, **options):
+        request = RequestFactory().post('/graphql')
+        request.user = AnonymousUser()
+        with CaptureQueriesContext(connection) as queries:
+            result = schema.execute(INDEX_QUERY, context=request)
+        if result.errors:
+            raise CommandError('\n'.join(map(str, result.errors)))
+        if options['verbose_sql']:
+            for query in queries.captured_queries:
+                self.stdout.write(query['sql'])
+        count = len(queries)
+        chat_count = len(result.data['chats'])
+        if count > options['max']:
+            raise CommandError('{} queries for {} chats, expected at most {}'.format(count, chat_count, options['max']))
+        self.stdout.write('{} queries for {} chats'.format(count, chat_count))
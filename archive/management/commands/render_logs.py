@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from archive.models import Log
+from archive.render import RENDER_VERSION
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = 'Render the stored HTML of logs which rendered by an old renderer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='render all logs')
+
+    def handle(self, *args, **options):
+        queryset = Log.objects.only('id', 'entities', 'rendered_html', 'rendered_version').order_by('id')
+        if not options['all']:
+            queryset = queryset.exclude(rendered_version=RENDER_VERSION)
+        batch = []
+        rendered = 0
+        for log in queryset.iterator(chunk_size=BATCH_SIZE):
+            log.render()
+            batch.append(log)
+            if len(batch) >= BATCH_SIZE:
+                Log.objects.bulk_update(batch, ['rendered_html', 'rendered_version'])
+                rendered += len(batch)
+                batch = []
+        if batch:
+            Log.objects.bulk_update(batch, ['rendered_html', 'rendered_version'])
+            rendered += len(batch)
+        self.stdout.write('{} logs rendered'.format(rendered))
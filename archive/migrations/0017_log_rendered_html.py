@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archive', '0016_delete_telegramprofile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='log',
+            name='rendered_html',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='log',
+            name='rendered_version',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archive', '0017_log_rendered_html'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='log',
+            index=models.Index(fields=['chat', 'deleted', 'created', 'id'], name='archive_log_keyset_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archive', '0018_log_keyset_idx'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        # `content__icontains` compiles to `UPPER(content) LIKE ...`, so index the same expression
+        migrations.RunSQL(
+            'CREATE INDEX archive_log_content_trgm ON archive_log USING gin (UPPER(content) gin_trgm_ops);',
+            'DROP INDEX archive_log_content_trgm;',
+        ),
+    ]
@@ -6,6 +6,9 @@ from typing import Optional
 from django.db import models
 from django.db.models import Count
 from django.contrib.postgres.fields import JSONField
+from django.utils.safestring import mark_safe
+
+from .render import render_entities, RENDER_VERSION
 
 
 class LogKind(Enum):
@@ -27,9 +30,9 @@ def choice(enum):
 def query_log(log_set, reverse):
     filtered = log_set.filter(deleted=False)
     if reverse:
-        queryset = filtered.order_by('-created')
+        queryset = filtered.order_by('-created', '-id')
     else:
-        queryset = filtered.order_by('created')
+        queryset = filtered.order_by('created', 'id')
     return queryset.select_related('reply').prefetch_related('tag')
 
 
@@ -84,6 +87,8 @@ class Log(models.Model):
     kind = models.IntegerField(choices=choice(LogKind), default=LogKind.NORMAL.value)
     content = models.TextField(default='', blank=True, null=False)
     entities = JSONField()
+    rendered_html = models.TextField(default='', blank=True, editable=False)
+    rendered_version = models.IntegerField(default=0, editable=False)
     media = models.FileField(upload_to='uploads/%Y/%m/%d/', blank=True)
     gm = models.BooleanField('GM', default=False)
     reply = models.ForeignKey('Log', on_delete=models.SET_NULL, null=True, blank=True, editable=False)
@@ -92,12 +97,30 @@ class Log(models.Model):
     modified = models.DateTimeField(auto_now=True)
     tag = models.ManyToManyField('Tag')
 
+    class Meta:
+        indexes = [
+            # keyset pagination of the chat page
+            models.Index(fields=['chat', 'deleted', 'created', 'id'], name='archive_log_keyset_idx'),
+        ]
+
     def reply_message_id(self):
         if self.reply:
             return self.reply.message_id
         else:
             return None
 
+    def render(self):
+        """
+        Render `entities` to `rendered_html`, call this before save whenever `entities` changed.
+        """
+        self.rendered_html = render_entities(self.entities)
+        self.rendered_version = RENDER_VERSION
+
+    def entities_html(self) -> str:
+        if self.rendered_version != RENDER_VERSION:
+            return render_entities(self.entities)
+        return mark_safe(self.rendered_html)
+
     def media_url(self):
         if self.media:
             return self.media.url
@@ -0,0 +1,122 @@
+import datetime
+from hashlib import md5
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+PAGE_SIZE = 150
+COUNT_TTL = 10 * 60
+
+Cursor = Tuple[datetime.datetime, int]
+
+
+def epoch() -> datetime.datetime:
+    if settings.USE_TZ:
+        return datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+    return datetime.datetime(1970, 1, 1)
+
+
+def encode_cursor(log) -> str:
+    timestamp = log.created - epoch()
+    return '{}-{}'.format(timestamp // datetime.timedelta(microseconds=1), log.id)
+
+
+def decode_cursor(text: Optional[str]) -> Optional[Cursor]:
+    if not text:
+        return None
+    try:
+        microseconds, log_id = map(int, text.split('-'))
+    except ValueError:
+        return None
+    return epoch() + datetime.timedelta(microseconds=microseconds), log_id
+
+
+def after(cursor: Cursor, descending: bool) -> Q:
+    """
+    Logs behind the cursor in (created, id) order.
+    """
+    created, log_id = cursor
+    if descending:
+        return Q(created__lt=created) | Q(created=created, id__lt=log_id)
+    return Q(created__gt=created) | Q(created=created, id__gt=log_id)
+
+
+class KeysetPage:
+    """
+    A page of logs located by the (created, id) of the log before or after it, instead of an offset.
+    """
+    def __init__(self, log_set, reverse: bool, after_cursor: Optional[Cursor] = None,
+                 before_cursor: Optional[Cursor] = None, last=False, size=PAGE_SIZE):
+        backward = before_cursor is not None or last
+        # `log_set` is ordered by (created, id), descending when reverse
+        queryset = log_set.reverse() if backward else log_set
+        if before_cursor is not None:
+            queryset = queryset.filter(after(before_cursor, descending=not reverse))
+        elif after_cursor is not None:
+            queryset = queryset.filter(after(after_cursor, descending=reverse))
+        object_list = list(queryset[:size + 1])
+        more = len(object_list) > size
+        object_list = object_list[:size]
+        if backward:
+            object_list.reverse()
+            self.has_previous = more
+            self.has_next = before_cursor is not None
+        else:
+            self.has_previous = after_cursor is not None
+            self.has_next = more
+        self.object_list = object_list
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def next_cursor(self) -> str:
+        return encode_cursor(self.object_list[-1]) if self.object_list else ''
+
+    def previous_cursor(self) -> str:
+        return encode_cursor(self.object_list[0]) if self.object_list else ''
+
+
+class OffsetPage:
+    """
+    A page of logs located by offset, for search results ordered by rank,
+    which is a computed value and not a good cursor.
+    """
+    def __init__(self, log_set, offset=0, size=PAGE_SIZE):
+        object_list = list(log_set[offset:offset + size + 1])
+        self.has_previous = offset > 0
+        self.has_next = len(object_list) > size
+        self.object_list = object_list[:size]
+        self.offset = offset
+        self.size = size
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def next_offset(self) -> int:
+        return self.offset + self.size
+
+    def previous_offset(self) -> int:
+        return max(self.offset - self.size, 0)
+
+
+def decode_offset(text: Optional[str]) -> int:
+    try:
+        return max(int(text), 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def approximate_count(log_set, *key) -> int:
+    """
+    Count of logs, cached for a while so it may be a little behind.
+    """
+    cache_key = 'archive:count:' + md5(':'.join(map(str, key)).encode()).hexdigest()
+    return cache.get_or_set(cache_key, log_set.count, COUNT_TTL)
@@ -0,0 +1,45 @@
+from typing import List
+
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import mark_safe
+
+# bump when the output changes, then run `manage.py render_logs` to update the stored HTML
+RENDER_VERSION = 1
+
+
+def render_entity(entity: dict) -> str:
+    kind = entity.get('kind')
+    if kind == 'span':
+        return format_html('<span class="entity-span">{}</span>', entity['value'])
+    elif kind == 'character' or kind == 'me':
+        return format_html('<strong class="entity-character" title="{}">{}</strong>',
+                           entity['full_name'], entity['value'])
+    elif kind == 'bold':
+        return format_html('<strong class="entity-bold">{}</strong>', entity['value'])
+    elif kind == 'code':
+        return format_html('<code class="entity-code">{}</code>', entity['value'])
+    elif kind == 'roll':
+        return format_html('<span class="entity-roll">{}</span>', entity['value'])
+    elif kind == 'coc-roll':
+        modifier = ''
+        if entity['modifier_name']:
+            modifier = format_html(
+                '<span class="modifier-name">{}</span><span class="modifier-list">{}</span>',
+                entity['modifier_name'], entity['rolled_list'],
+            )
+        return format_html(
+            '<span class="entity-coc-roll"><span class="rolled">{}</span><span class="level">{}</span>{}</span>',
+            entity['rolled'], entity['level'], modifier,
+        )
+    elif kind == 'loop-roll':
+        rolled = entity['rolled']
+        return format_html(
+            '<span class="entity-loop-roll"><span class="counter">{}/{}</span><span class="rolled">{}</span></span>',
+            rolled.count(6), len(rolled), rolled,
+        )
+    else:
+        return mark_safe('<span class="entity-unknown">Unknown</span>')
+
+
+def render_entities(entities: List[dict]) -> str:
+    return format_html_join('', '{}', ((render_entity(entity),) for entity in entities))
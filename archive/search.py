@@ -0,0 +1,62 @@
+import re
+from typing import List
+
+from django.contrib.postgres.search import TrigramSimilarity
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+SEARCH_LIMIT = 150
+
+CJK_REGEX = re.compile(r'([\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]+)')
+TAG_REGEX = re.compile(r'(<[^>]*>)')
+CHAR_REFERENCE = r'&#?\w+;'
+
+
+def split_keywords(search: str) -> List[str]:
+    """
+    Split the search text by whitespace and at the boundaries of CJK characters,
+    because CJK text does not separate words by space, e.g. "检定SAN值" -> ["检定", "SAN", "值"].
+    """
+    keywords = []
+    for word in search.split():
+        for part in CJK_REGEX.split(word):
+            part = part.strip()
+            if part and part.lower() not in keywords:
+                keywords.append(part.lower())
+    return keywords
+
+
+def search_logs(log_set, search: str):
+    """
+    Logs contain all keywords, the most similar first.
+
+    `icontains` compiles to `UPPER(content) LIKE`, which is served by the trigram index
+    on `UPPER(content)` (migration 0019). A keyword shorter than 3 characters has no trigram,
+    e.g. most CJK words, so it can not narrow the index scan; its filter is only checked
+    on the rows matched by the longer keywords, or on every row if there is none.
+    """
+    keywords = split_keywords(search)
+    for keyword in keywords:
+        log_set = log_set.filter(content__icontains=keyword)
+    return log_set.annotate(rank=TrigramSimilarity('content', ' '.join(keywords))).order_by('-rank', '-created', '-id')
+
+
+def highlight(html: str, keywords: List[str]) -> str:
+    """
+    Wrap keywords in the text (not the tags) of the HTML with <mark>.
+    """
+    if not keywords:
+        return html
+    matched_keywords = '|'.join(re.escape(escape(keyword)) for keyword in keywords)
+    # skip the character references, e.g. do not mark "amp" in "&amp;"
+    pattern = re.compile('({})|({})'.format(CHAR_REFERENCE, matched_keywords), re.IGNORECASE)
+
+    def mark(matched):
+        if matched.group(1):
+            return matched.group(1)
+        return '<mark>{}</mark>'.format(matched.group(2))
+
+    parts = TAG_REGEX.split(html)
+    for i in range(0, len(parts), 2):
+        parts[i] = pattern.sub(mark, parts[i])
+    return mark_safe(''.join(parts))
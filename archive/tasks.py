@@ -0,0 +1,61 @@
+from django.core.cache import cache
+from django.db import transaction
+
+from archive import artifacts
+from archive.models import Chat
+from play_trpg.celery import app
+
+# wait for more changes before writing the export files
+APPEND_DELAY = 10
+BUILD_DELAY = 60
+LOCK_TIMEOUT = 10 * 60
+
+
+def pending_key(name, chat_id):
+    return 'export:{}:{}'.format(name, chat_id)
+
+
+def lock(chat_id):
+    return cache.lock('export:lock:{}'.format(chat_id), timeout=LOCK_TIMEOUT)
+
+
+@app.task
+def append_export_task(chat_id):
+    cache.delete(pending_key('append', chat_id))
+    chat = Chat.objects.filter(id=chat_id).first()
+    if chat is None:
+        return
+    with lock(chat_id):
+        artifacts.append(chat)
+
+
+@app.task
+def build_export_task(chat_id):
+    cache.delete(pending_key('build', chat_id))
+    chat = Chat.objects.filter(id=chat_id).first()
+    if chat is None:
+        return
+    with lock(chat_id):
+        artifacts.build(chat)
+
+
+def schedule(task, name, chat_id, delay):
+    def send():
+        # at most one pending task of a kind for each chat
+        if cache.add(pending_key(name, chat_id), True, delay * 2):
+            task.apply_async((chat_id,), countdown=delay)
+    transaction.on_commit(send)
+
+
+def append_export(chat_id):
+    """
+    New logs of the chat created.
+    """
+    schedule(append_export_task, 'append', chat_id, APPEND_DELAY)
+
+
+def rebuild_export(chat_id):
+    """
+    Logs of the chat edited or deleted.
+    """
+    schedule(build_export_task, 'build', chat_id, BUILD_DELAY)
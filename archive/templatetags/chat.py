@@ -13,3 +13,14 @@ def url_replace(context, field, value):
 @register.filter
 def counter_6(xs: list):
     return xs.count(6)
+
+
+@register.simple_tag(takes_context=True)
+def cursor_replace(context, after='', before='', last=''):
+    dict_ = context['request'].GET.copy()
+    for field, value in (('after', after), ('before', before), ('last', last)):
+        if value:
+            dict_[field] = value
+        else:
+            dict_.pop(field, None)
+    return dict_.urlencode()
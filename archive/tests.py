@@ -1 +1,31 @@
-# Create your tests here.
+import datetime
+
+from django.test import TestCase, RequestFactory
+
+from archive.management.commands.graphql_queries import INDEX_QUERY, MAX_INDEX_QUERIES
+from archive.models import Chat, Log
+from game.models import Player
+from schema import schema
+
+
+class IndexQueryTest(TestCase):
+    def setUp(self):
+        now = datetime.datetime.now()
+        for i in range(5):
+            chat = Chat.objects.create(chat_id=-1000 - i, title='Chat {}'.format(i))
+            for j in range(3):
+                Player.objects.create(chat_id=chat.chat_id, user_id=j, character_name='Player {}'.format(j),
+                                      full_name='User {}'.format(j))
+            for j in range(i):
+                Log.objects.create(chat=chat, user_id=0, message_id=j, content='log', entities=[], created=now)
+            Log.objects.create(chat=chat, user_id=0, message_id=i, entities=[], created=now, deleted=True)
+
+    def test_query_count(self):
+        request = RequestFactory().post('/graphql')
+        # not growing with the number of chats
+        with self.assertNumQueries(MAX_INDEX_QUERIES):
+            result = schema.execute(INDEX_QUERY, context=request)
+        self.assertIsNone(result.errors)
+        chats = sorted(result.data['chats'], key=lambda chat: chat['title'])
+        self.assertEqual([chat['counter'] for chat in chats], [0, 1, 2, 3, 4])
+        self.assertTrue(all(len(chat['players']) == 3 for chat in chats))
@@ -1,13 +1,17 @@
 from typing import Optional
 import datetime
+import os
 
-from django.http import HttpResponseBadRequest
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseBadRequest, FileResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
-from django.views.decorators.cache import cache_page
-from django.core.paginator import Paginator
 
 from . import forms
+from .artifacts import artifact_path, artifact_name, EXPORT_FORMATS
 from .export import EXPORT_METHOD
+from .tasks import rebuild_export
+from .pagination import KeysetPage, OffsetPage, decode_cursor, decode_offset, approximate_count
+from .search import search_logs, split_keywords, highlight
 from .models import Chat, Tag
 from user.models import TelegramProfile
 from game.models import Player
@@ -42,7 +46,10 @@ def chat_page(request, chat_id):
     tag_id = request.GET.get('tag', None)
     reverse = request.GET.get('reverse', '0') != '0'
     search: Optional[str] = request.GET.get('search', None)
-    page_number = int(request.GET.get('page', 1))
+    after_cursor = request.GET.get('after', '')
+    before_cursor = request.GET.get('before', '')
+    last = request.GET.get('last', '0') != '0'
+    offset = decode_offset(request.GET.get('offset'))
     tag: Optional[Tag] = None
 
     player = None
@@ -60,14 +67,21 @@ def chat_page(request, chat_id):
     if tag:
         log_set = tag.query_log(reverse=reverse)
     if search:
-        for keyword in search.split():
-            log_set = log_set.filter(content__icontains=keyword)
-    paginator = Paginator(log_set, per_page=150)
-    page = paginator.page(page_number)
+        log_set = search_logs(log_set, search)
+        log_count = approximate_count(log_set, chat.id, tag_id, search)
+        # ordered by rank, paginated by offset
+        page = OffsetPage(log_set, offset)
+        keywords = split_keywords(search)
+        for log in page:
+            log.highlighted_html = highlight(log.entities_html(), keywords)
+    else:
+        page = KeysetPage(log_set, reverse, decode_cursor(after_cursor), decode_cursor(before_cursor), last)
+        log_count = approximate_count(log_set, chat.id, tag_id)
     context = dict(
         chat=chat,
-        page_number=page_number,
+        page_key='{}:{}:{}:{}'.format(after_cursor, before_cursor, last, offset),
         log_list=page,
+        log_count=log_count,
         tag_list=tag_list,
         reverse=reverse,
         tag=tag,
@@ -94,7 +108,6 @@ def require_password(request, chat_id):
     return render(request, 'require-password.html', context, status=401)
 
 
-@cache_page(60)
 def export(request, chat_id, _title: str, method: str):
     now = datetime.datetime.now()
     current = get_object_or_404(Chat, id=chat_id)
@@ -105,6 +118,22 @@ def export(request, chat_id, _title: str, method: str):
     method = method.strip()
     if method not in EXPORT_METHOD:
         return HttpResponseBadRequest('Bad Request')
-    return EXPORT_METHOD[method](filename, current)
-
-
+    path = artifact_path(current.id, method)
+    if method not in EXPORT_FORMATS or not os.path.exists(path):
+        if method in EXPORT_FORMATS:
+            # not built yet, stream this time
+            rebuild_export(current.id)
+        generate, content_type, attachment = EXPORT_METHOD[method]
+        response = StreamingHttpResponse(generate(current), content_type=content_type)
+        if attachment:
+            response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(filename, method)
+        return response
+    if settings.EXPORT_ACCEL_REDIRECT:
+        # nginx sends the file, with ETag and Range support
+        response = HttpResponse(content_type='application/gzip')
+        response['X-Accel-Redirect'] = '{}{}/{}'.format(
+            settings.EXPORT_ACCEL_REDIRECT, current.id, artifact_name(method))
+    else:
+        response = FileResponse(open(path, 'rb'), content_type='application/gzip')
+    response['Content-Disposition'] = 'attachment; filename="{}.{}.gz"'.format(filename, method)
+    return response
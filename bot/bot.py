@@ -3,14 +3,18 @@ import logging
 import re
 from hashlib import sha256
 from functools import partial
+from queue import Queue
 
 import telegram
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackQueryHandler, CallbackContext
+from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackQueryHandler, CallbackContext, \
+    Dispatcher, JobQueue
+from telegram.utils.request import Request
 from django.conf import settings
 
 from bot.say import handle_as_say, handle_say, get_tag
 from bot.system import Deletion
+from bot.rate_limit import limiter
 from bot.variable import handle_list_variables, handle_variable_assign, handle_clear_variables
 from .roll import set_dice_face, handle_coc_roll, handle_loop_roll, handle_normal_roll, hide_roll_callback, \
     handle_set_dice_face
@@ -19,7 +23,8 @@ from .round_counter import round_inline_callback, start_round, hide_round,\
     public_round, next_turn, handle_initiative
 from . import patterns
 from .display import Text, get_by_user, get
-from .system import Context, is_group_chat, is_gm, get_chat, get_player_by_id
+from .scheduler import ChatDispatcher, report_metrics
+from .system import Context, is_group_chat, is_gm, get_chat, get_player_by_id, update_scope
 from bot.tasks import send_message, delete_message, cancel_delete_message, after_edit_delete_previous_message, \
     error_message
 
@@ -76,6 +81,7 @@ def handle_save(message: telegram.Message, **_kwargs):
         chat.recording = False
         chat.save_date = datetime.datetime.now()
         chat.save()
+        limiter.record(message.chat_id)
         message.chat.send_message('#save {}'.format(_(Text.SAVE)))
     else:
         error_message(message, _(Text.ALREADY_SAVED))
@@ -88,6 +94,7 @@ def help_command(update, _context: CallbackContext):
 
 def handle_help(message: telegram.Message, **_kwargs):
     send_text = get_by_user(Text.HELP_TEXT, message.from_user)
+    limiter.record(message.chat_id)
     message.reply_text(send_text, parse_mode='HTML', reply_markup=login_button())
 
 
@@ -112,6 +119,7 @@ def handle_delete_callback(_bot: telegram.Bot, query: telegram.CallbackQuery):
         query.answer(_(Text.DELETED))
 
 
+@update_scope()
 def inline_callback(bot, update):
     query = update.callback_query
     assert isinstance(query, telegram.CallbackQuery)
@@ -196,6 +204,7 @@ def handle_delete(
         reply_markup = delete_reply_markup(message.from_user.language_code)
         deletion = Deletion(message.chat_id, message.from_user.id, message_list=[log.message_id])
     delete_message(message.chat_id, message.message_id)
+    limiter.record(message.chat_id)
     sent = message.chat.send_message(check_text, parse_mode='HTML', reply_markup=reply_markup)
     deletion.set(sent.message_id)
     delete_message(message.chat_id, sent.message_id, 30)
@@ -241,6 +250,7 @@ def handle_add_tag(bot: telegram.Bot, chat, message: telegram.Message, **_kwargs
 
     tag_text = ''.join([' #{}'.format(tag.name) for tag in tag_list])
 
+    limiter.record(target.chat_id)
     if target.photo:
         edit_text = str(target.caption_html) + tag_text
         bot.edit_message_caption(
@@ -329,6 +339,8 @@ message_handlers = [
     (re.compile(r'^[.。[【](tag)\b'), handle_add_tag),
 ]
 
+message_dispatcher = patterns.Dispatcher(message_handlers)
+
 
 def start_gm_mode(bot: telegram.Bot, message: telegram.Message, chat: Chat):
     _ = partial(get_by_user, user=message.from_user)
@@ -336,6 +348,7 @@ def start_gm_mode(bot: telegram.Bot, message: telegram.Message, chat: Chat):
         return
     chat.gm_mode = True
     chat.save()
+    limiter.record(chat.chat_id)
     sent = bot.send_message(chat.chat_id, _(Text.START_GM_MODE), parse_mode='HTML')
     chat.gm_mode_notice = sent.message_id
     chat.save()
@@ -372,6 +385,7 @@ def is_command(text: str) -> bool:
     return text.startswith(('.', '。'))
 
 
+@update_scope()
 def handle_message(update: telegram.Update, context: CallbackContext):
     bot = context .bot
     message: telegram.Message = update.message
@@ -402,6 +416,7 @@ def handle_message(update: telegram.Update, context: CallbackContext):
         return
 
     if not is_group_chat(message.chat):
+        limiter.record(message.chat_id)
         message.reply_text(_(Text.NOT_GROUP))
         return
 
@@ -440,33 +455,31 @@ def handle_message(update: telegram.Update, context: CallbackContext):
 
     name = player.character_name
 
-    for pattern, handler in message_handlers:
-        result = patterns.split(pattern, text)
-        if not result:
-            continue
-        command, start = result
-        rest = text[start:]
-        if handler is not handle_as_say and edit_log:
-            after_edit_delete_previous_message(edit_log.id)
-
-        handler(
-            bot=bot,
-            chat=chat,
-            player=player,
-            command=command,
-            start=start,
-            name=name,
-            text=rest,
-            message=message,
-            job_queue=context.job_queue,
-            with_photo=with_photo,
-            language_code=language_code,
-            edit_log=edit_log,
-            context=Context(bot, chat, player, command, name, start, rest, message,
-                            context.job_queue, language_code, with_photo, edit_log)
-        )
+    dispatched = message_dispatcher.match(text)
+    if not dispatched:
+        handle_say(chat, message, name, edit_log=edit_log, with_photo=with_photo, start=1)
         return
-    handle_say(chat, message, name, edit_log=edit_log, with_photo=with_photo, start=1)
+    handler, command, start = dispatched
+    rest = text[start:]
+    if handler is not handle_as_say and edit_log:
+        after_edit_delete_previous_message(edit_log.id)
+
+    handler(
+        bot=bot,
+        chat=chat,
+        player=player,
+        command=command,
+        start=start,
+        name=name,
+        text=rest,
+        message=message,
+        job_queue=context.job_queue,
+        with_photo=with_photo,
+        language_code=language_code,
+        edit_log=edit_log,
+        context=Context(bot, chat, player, command, name, start, rest, message,
+                        context.job_queue, language_code, with_photo, edit_log)
+    )
 
 
 def get_maximum_photo(message: telegram.Message):
@@ -517,14 +530,7 @@ def set_password(update, context: CallbackContext):
     send_message(message.chat_id, _(Text.PASSWORD_SUCCESS), message.message_id)
 
 
-def run_bot():
-    """Start the bot."""
-    # Create the EventHandler and pass it your bot's token.
-    updater = Updater(settings.BOT_TOKEN, use_context=True)
-
-    # Get the dispatcher to register handlers
-    dp = updater.dispatcher
-
+def add_handlers(dp: Dispatcher):
     # on different commands - answer in Telegram
     dp.add_handler(CommandHandler("start", start_command))
     dp.add_handler(CommandHandler("save", save_command))
@@ -547,6 +553,49 @@ def run_bot():
     # log all errors
     dp.add_error_handler(handle_error)
 
+
+def make_updater() -> Updater:
+    """
+    Updater with a dispatcher which process updates of different chats concurrently.
+    """
+    request = Request(con_pool_size=settings.BOT_SHARDS + 4)
+    bot = telegram.Bot(settings.BOT_TOKEN, base_url=settings.TELEGRAM_BASE_URL, request=request)
+    job_queue = JobQueue()
+    dp = ChatDispatcher(
+        bot,
+        Queue(maxsize=settings.BOT_UPDATE_QUEUE_SIZE),
+        shards=settings.BOT_SHARDS,
+        job_queue=job_queue,
+        use_context=True,
+    )
+    job_queue.set_dispatcher(dp)
+    job_queue.run_repeating(report_metrics, interval=settings.BOT_METRICS_INTERVAL)
+    updater = Updater(dispatcher=dp, workers=None, use_context=True)
+    add_handlers(dp)
+    return updater
+
+
+def run_webhook():
+    """
+    Receive updates by webhook.
+    """
+    updater = make_updater()
+    url_path = 'webhook/{}'.format(settings.BOT_TOKEN)
+    updater.start_webhook(
+        listen=settings.BOT_WEBHOOK_LISTEN,
+        port=settings.BOT_WEBHOOK_PORT,
+        url_path=url_path,
+        webhook_url='{}/{}'.format(settings.BOT_WEBHOOK_URL.rstrip('/'), settings.BOT_TOKEN),
+    )
+    updater.idle()
+
+
+def run_bot():
+    """Start the bot."""
+    if settings.BOT_WEBHOOK_URL:
+        return run_webhook()
+    updater = make_updater()
+
     # Start the Bot
     updater.start_polling()
 
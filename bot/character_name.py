@@ -7,18 +7,20 @@ from telegram.ext import CallbackContext
 from bot.tasks import send_message, delete_message, error_message
 from .round_counter import create_player
 from .display import Text, get_by_user
+from .system import get_player_by_id
 from game.models import Player
 
 
 def set_temp_name(chat_id, user_id, temp_name):
-    player = Player.objects.filter(chat_id=chat_id, user_id=user_id).first()
+    player = get_player_by_id(chat_id, user_id)
     if player:
         player.temp_character_name = temp_name
-        player.save()
+        # the player may be a stale copy from the cache, do not write back the other columns
+        player.save(update_fields=['temp_character_name'])
 
 
 def get_temp_name(chat_id, user_id):
-    player = Player.objects.filter(chat_id=chat_id, user_id=user_id).first()
+    player = get_player_by_id(chat_id, user_id)
     if player:
         return player.temp_character_name or ''
 
@@ -47,7 +49,7 @@ def set_name(update: telegram.Update, context: CallbackContext):
 
 def get_name(message: telegram.Message, temp=False) -> Optional[str]:
     user_id = message.from_user.id
-    player = Player.objects.filter(chat_id=message.chat_id, user_id=user_id).first()
+    player = get_player_by_id(message.chat_id, user_id)
     if not player:
         return None
     elif temp:
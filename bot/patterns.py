@@ -32,3 +32,27 @@ def split(patterns, text: str) -> Optional[Tuple[str, int]]:
     else:
         command = result.group(1)
         return command, result.end()
+
+
+class Dispatcher:
+    """
+    Match all command patterns at once, patterns are tried in the order of the list.
+    """
+    def __init__(self, handlers):
+        self.handlers = handlers
+        self.group_handler = {}
+        alternatives = []
+        group = 1
+        for pattern, handler in handlers:
+            alternatives.append('(?:{})'.format(pattern.pattern))
+            for index in range(group, group + pattern.groups):
+                self.group_handler[index] = (group, handler)
+            group += pattern.groups
+        self.regex = re.compile('|'.join(alternatives))
+
+    def match(self, text: str):
+        result = self.regex.match(text.lower())
+        if result is None:
+            return None
+        group, handler = self.group_handler[result.lastindex]
+        return handler, result.group(group), result.end()
@@ -0,0 +1,99 @@
+import time
+
+from django_redis import get_redis_connection
+
+# Telegram allows about 20 messages per minute in a group, and 30 messages per second in total.
+# Private chats have no per-chat limit of that kind, only the global one applies.
+CHAT_CAPACITY = 20
+CHAT_RATE = 20 / 60
+GLOBAL_CAPACITY = 30
+GLOBAL_RATE = 30
+
+BUCKET_EXPIRE = 60 * 60
+
+# Modes of the script
+TAKE = 'take'  # take one token from every bucket, or return the seconds to wait without taking any
+FORCE = 'force'  # take one token even if the bucket is short, for sends which have been made
+PEEK = 'peek'  # only return the seconds to wait
+
+# KEYS: bucket keys, ARGV: now, expire, mode, then capacity and rate of each bucket
+TOKEN_BUCKET_SCRIPT = '''
+local now = tonumber(ARGV[1])
+local expire = tonumber(ARGV[2])
+local mode = ARGV[3]
+local wait = 0
+local tokens = {}
+local capacities = {}
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2 + 2])
+    local rate = tonumber(ARGV[i * 2 + 3])
+    local state = redis.call('HMGET', key, 'tokens', 'time')
+    local current = tonumber(state[1]) or capacity
+    local last = tonumber(state[2]) or now
+    current = math.min(capacity, current + math.max(now - last, 0) * rate)
+    tokens[i] = current
+    capacities[i] = capacity
+    if current < 1 then
+        wait = math.max(wait, (1 - current) / rate)
+    end
+end
+if mode == 'peek' or (mode == 'take' and wait > 0) then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    -- the debt of forced tokens is bounded by the capacity
+    local left = math.max(tokens[i] - 1, -capacities[i])
+    redis.call('HSET', key, 'tokens', tostring(left), 'time', tostring(now))
+    redis.call('EXPIRE', key, expire)
+end
+return '0'
+'''
+
+
+class RateLimiter:
+    """
+    Token buckets for each chat and a global one, shared by all workers through Redis.
+    """
+    def __init__(self, redis=None, chat_capacity=CHAT_CAPACITY, chat_rate=CHAT_RATE,
+                 global_capacity=GLOBAL_CAPACITY, global_rate=GLOBAL_RATE):
+        self.redis = redis
+        self.chat_capacity = chat_capacity
+        self.chat_rate = chat_rate
+        self.global_capacity = global_capacity
+        self.global_rate = global_rate
+        self.script = None
+
+    def run(self, chat_id, mode: str) -> float:
+        if self.script is None:
+            self.redis = self.redis or get_redis_connection()
+            self.script = self.redis.register_script(TOKEN_BUCKET_SCRIPT)
+        keys = ['rate_limit:global']
+        args = [time.time(), BUCKET_EXPIRE, mode, self.global_capacity, self.global_rate]
+        if chat_id < 0:
+            # groups and channels
+            keys.append('rate_limit:chat:{}'.format(chat_id))
+            args.extend((self.chat_capacity, self.chat_rate))
+        return float(self.script(keys=keys, args=args))
+
+    def acquire(self, chat_id) -> float:
+        """
+        Take a token for sending to the chat, return 0 or the seconds to wait before try again.
+        """
+        return self.run(chat_id, TAKE)
+
+    def record(self, chat_id):
+        """
+        Take a token without waiting, for sending which needs the result at once.
+
+        The bot checks `delay` before handling an update instead, see `bot.scheduler`.
+        """
+        self.run(chat_id, FORCE)
+
+    def delay(self, chat_id) -> float:
+        """
+        Seconds to wait before a token for the chat is available, without taking it.
+        """
+        return self.run(chat_id, PEEK)
+
+
+limiter = RateLimiter()
@@ -9,10 +9,12 @@ from telegram.ext import CallbackContext
 import dice
 from entities import RollResult, Span, CocResult, LoopResult, Entities
 from archive.models import LogKind, Log, Chat
+from archive.tasks import append_export
 from .patterns import LOOP_ROLL_REGEX
 from .system import RpgMessage, get_chat, HideRoll, \
     is_gm
 from bot.tasks import send_message, delete_message, error_message
+from bot.rate_limit import limiter
 from .display import Text, get_by_user
 
 
@@ -174,6 +176,7 @@ def handle_roll(message: telegram.Message, name: str, entities: Entities, chat:
         reply_markup = None
     if not chat.recording:
         text = '[{}] '.format(_(Text.NOT_RECORDING)) + text
+    limiter.record(message.chat_id)
     sent = message.chat.send_message(
         text,
         reply_markup=reply_markup,
@@ -182,7 +185,7 @@ def handle_roll(message: telegram.Message, name: str, entities: Entities, chat:
     user = message.from_user
     assert isinstance(user, telegram.User)
     if chat.recording:
-        Log.objects.create(
+        log = Log(
             user_id=user.id,
             message_id=sent.message_id,
             chat=chat,
@@ -194,6 +197,9 @@ def handle_roll(message: telegram.Message, name: str, entities: Entities, chat:
             kind=kind,
             created=message.date,
         )
+        log.render()
+        log.save()
+        append_export(chat.id)
         chat.save()
     delete_message(message.chat_id, message.message_id, 25)
 
@@ -2,55 +2,45 @@ from functools import partial
 from typing import Optional
 
 import telegram
-from django.db import transaction
 
-from bot.tasks import update_round_message_task, answer_callback_query, edit_message, error_message, delete_message
+from bot.tasks import schedule_round_message, answer_callback_query, edit_message, error_message, delete_message
 from .system import NotGm, is_group_chat, is_gm, bot
+from .rate_limit import limiter
 from .patterns import INITIATIVE_REGEX
-from game.models import Round, Player, Actor
+from game import initiative
+from game.models import Round, Player
 from .display import Text, get_by_user, get, get_language
 
 
-def round_inline_handle(_bot: telegram.Bot, query: telegram.CallbackQuery, gm: bool, game_round: Round):
+def round_inline_handle(_bot: telegram.Bot, query: telegram.CallbackQuery, gm: bool, chat_id: int):
     language_code = get_language(query.from_user)
 
     def _(x):
         return get(x, language_code)
 
     method = str(query.data)
-    actors = game_round.get_actors()
     if method == 'round:next':
-        next_count = game_round.counter + 1
-        if next_count >= len(actors):
-            next_count = 0
-            game_round.round_counter += 1
-        game_round.counter = next_count
-        game_round.save()
+        initiative.next_turn(chat_id)
         answer_callback_query(query.id)
-        update_round_message(game_round, language_code)
+        update_round_message(chat_id, language_code)
     elif method == 'round:prev':
-        prev_count = game_round.counter - 1
-        if prev_count < 0:
-            if game_round.round_counter <= 1:
-                answer_callback_query(query.id, _(Text.ALREADY_FIRST_TURN))
-                return
-            else:
-                prev_count = len(actors) - 1
-                game_round.round_counter -= 1
-        game_round.counter = prev_count
+        result = initiative.prev_turn(chat_id)
+        if result is None:
+            answer_callback_query(query.id)
+            return
+        counter, _round_counter = result
+        if counter == initiative.ALREADY_FIRST:
+            answer_callback_query(query.id, _(Text.ALREADY_FIRST_TURN))
+            return
         answer_callback_query(query.id)
-        update_round_message(game_round, language_code, refresh=True)
-        game_round.save()
+        update_round_message(chat_id, language_code, refresh=True)
     elif method == 'round:remove':
         if not gm:
             raise NotGm()
 
-        actors = game_round.get_actors()
-        if len(actors) > 1:
-            current = actors[game_round.counter % len(actors)]
-            current.delete()
+        if initiative.remove_current(chat_id):
             answer_callback_query(query.id)
-            update_round_message(game_round, language_code, refresh=True)
+            update_round_message(chat_id, language_code, refresh=True)
         else:
             answer_callback_query(query.id, _(Text.AT_LEAST_ONE_ACTOR), show_alert=True)
     elif method == 'round:finish':
@@ -58,20 +48,19 @@ def round_inline_handle(_bot: telegram.Bot, query: telegram.CallbackQuery, gm: b
             raise NotGm()
         message: telegram.Message = query.message
         edit_message(message.chat_id, message.message_id, _(Text.ROUND_ALREADY_FINISHED))
-        remove_round(game_round.chat_id)
+        remove_round(chat_id)
 
 
 def round_inline_callback(_bot: telegram.Bot, query: telegram.CallbackQuery, gm: bool):
-    game_round = Round.objects.filter(chat_id=query.message.chat_id).first()
+    chat_id = query.message.chat_id
 
     def _(t: Text):
         get_by_user(t, query.from_user)
-    if not isinstance(game_round, Round):
+    if not initiative.load(chat_id):
         answer_callback_query(query.id, _(Text.GAME_NOT_IN_ROUND), show_alert=True)
         return
     try:
-        with transaction.atomic():
-            round_inline_handle(bot, query, gm, game_round)
+        round_inline_handle(bot, query, gm, chat_id)
     except NotGm:
         answer_callback_query(query.id, _(Text.NOT_GM), show_alert=True)
 
@@ -81,10 +70,11 @@ def remove_round(chat_id):
         message_id = game_round.message_id
         game_round.delete()
         delete_message(chat_id, message_id)
+    initiative.discard(chat_id)
 
 
-def update_round_message(game_round: Round, language_code, refresh=False):
-    update_round_message_task.delay(game_round.chat_id, language_code, refresh)
+def update_round_message(chat_id, language_code, refresh=False):
+    schedule_round_message(chat_id, language_code, refresh)
 
 
 def start_round(update: telegram.Update, _context):
@@ -97,6 +87,7 @@ def start_round(update: telegram.Update, _context):
     text = '{} #round\n\n\n{}'.format(_(Text.ROUND_INDICATOR), _(Text.ROUND_INDICATOR_INIT))
     delete_message(message.chat_id, message.message_id)
 
+    limiter.record(chat.id)
     sent = chat.send_message(text, parse_mode='HTML')
 
     message_id = sent.message_id
@@ -131,9 +122,10 @@ def hide_round(update: telegram.Update, _context):
         return
     if not is_gm(message.chat_id, message.from_user.id):
         return error_message(message, _(Text.NOT_GM))
-    game_round.hide = True
-    game_round.save()
-    update_round_message(game_round, language_code, refresh=True)
+    # only the column, the counters in the row may be behind Redis
+    Round.objects.filter(chat_id=game_round.chat_id).update(hide=True)
+    initiative.set_field(game_round.chat_id, 'hide', True)
+    update_round_message(game_round.chat_id, language_code, refresh=True)
     delete_message(message.chat_id, message.message_id)
 
 
@@ -146,25 +138,21 @@ def public_round(update: telegram.Update, _context):
     if not is_gm(update.message.chat_id, update.message.from_user.id):
         error_text = get_by_user(Text.NOT_GM, update.message.from_user)
         return error_message(update.message, error_text)
-    game_round.hide = False
-    game_round.save()
-    update_round_message(game_round, language_code, refresh=True)
+    Round.objects.filter(chat_id=game_round.chat_id).update(hide=False)
+    initiative.set_field(game_round.chat_id, 'hide', False)
+    update_round_message(game_round.chat_id, language_code, refresh=True)
     delete_message(message.chat_id, message.message_id)
 
 
 def next_turn(update: telegram.Update, _context):
-    game_round = get_round(update)
-    if not game_round:
-        return
-    actors = game_round.get_actors()
-    next_count = game_round.counter + 1
-    if next_count >= len(actors):
-        next_count = 0
-        game_round.round_counter += 1
-    game_round.counter = next_count
-    game_round.save()
+    message = update.message
+    assert isinstance(message, telegram.Message)
+    if not is_group_chat(message.chat):
+        return error_message(message, get_by_user(Text.NOT_GROUP, message.from_user))
+    if initiative.next_turn(message.chat_id) is None:
+        return error_message(message, get_by_user(Text.GAME_NOT_IN_ROUND, message.from_user))
     language_code = get_language(update.message.from_user)
-    update_round_message(game_round, language_code, refresh=False)
+    update_round_message(message.chat_id, language_code, refresh=False)
     delete_message(update.message.chat_id, update.message.message_id)
 
 
@@ -207,9 +195,9 @@ def handle_initiative(message: telegram.Message, name: str, text: str, **__):
         error_message(message, usage)
         return
 
-    game_round = Round.objects.filter(chat_id=message.chat_id).first()
-    if not isinstance(game_round, Round):
+    if not initiative.load(message.chat_id):
         error_message(message, _(Text.INIT_WITHOUT_ROUND))
-    Actor.objects.create(belong_id=message.chat_id, name=name, value=int(number))
-    update_round_message(game_round, language_code, refresh=True)
+        return
+    initiative.add_actor(message.chat_id, name, int(number))
+    update_round_message(message.chat_id, language_code, refresh=True)
     delete_message(message.chat_id, message.message_id)
@@ -5,9 +5,11 @@ import telegram
 from bot.tasks import set_photo_task, edit_message, edit_message_photo, edit_message_caption, delete_message, \
     error_message
 from archive.models import LogKind, Log, Tag, Chat
+from archive.tasks import append_export, rebuild_export
 from . import display, patterns
 from .character_name import set_temp_name, get_temp_name
 from .system import RpgMessage, is_gm, bot
+from .rate_limit import limiter
 from .display import Text, get_by_user
 
 
@@ -98,6 +100,7 @@ def send_and_record(chat, gm, kind, message: telegram.Message, name, reply_log,
     if isinstance(reply_log, Log):
         reply_to_message_id = reply_log.message_id
     # send message
+    limiter.record(message.chat_id)
     if isinstance(with_photo, telegram.PhotoSize):
         sent = message.chat.send_photo(
             photo=with_photo,
@@ -114,7 +117,7 @@ def send_and_record(chat, gm, kind, message: telegram.Message, name, reply_log,
     if not chat.recording:
         return
     # record log
-    created_log = Log.objects.create(
+    created_log = Log(
         message_id=sent.message_id,
         source_message_id=message.message_id,
         chat=chat,
@@ -129,6 +132,9 @@ def send_and_record(chat, gm, kind, message: telegram.Message, name, reply_log,
         gm=gm,
         created=message.date,
     )
+    created_log.render()
+    created_log.save()
+    append_export(chat.id)
     for name in rpg_message.tags:
         created_log.tag.add(get_tag(chat, name))
     created_log.save()
@@ -156,8 +162,10 @@ def on_edit(chat: Chat, edit_log: Log, kind, message, rpg_message: RpgMessage, s
         edit_log.tag.add(tag)
     edit_log.content = text
     edit_log.entities = rpg_message.entities.to_object()
+    edit_log.render()
     edit_log.kind = kind
     edit_log.save()
+    rebuild_export(chat.id)
     delete_message(message.chat_id, message.message_id, 25)
     chat.save()
     return
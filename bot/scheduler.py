@@ -0,0 +1,181 @@
+import logging
+import threading
+import time
+from queue import Queue
+from typing import List, Dict, Tuple
+
+import telegram
+from telegram.ext import Dispatcher, CallbackContext
+from django.core.cache import cache
+from django.db import close_old_connections
+
+from .rate_limit import limiter as default_limiter
+
+logger = logging.getLogger(__name__)
+
+METRICS_KEY = 'bot:scheduler:metrics'
+
+Item = Tuple[float, object]
+
+
+class Resume:
+    """
+    Put in a shard queue when the deferred updates of the chat may be processed.
+    """
+    def __init__(self, chat_id: int):
+        self.chat_id = chat_id
+
+
+def chat_id_of(update: telegram.Update) -> int:
+    chat = update.effective_chat
+    return chat.id if chat else 0
+
+
+class Shard:
+    def __init__(self, index: int, dispatcher: 'ChatDispatcher', queue_size: int):
+        self.index = index
+        self.dispatcher = dispatcher
+        self.queue = Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self.run, name='chat_shard_{}'.format(index), daemon=True)
+        self.lock = threading.Lock()
+        self.processed = 0
+        self.deferred = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        # updates of rate limited chats, in order, only touched by the shard thread
+        self.pending: Dict[int, List[Item]] = {}
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            try:
+                _enqueued, update = item
+                if isinstance(update, Resume):
+                    self.resume(update.chat_id)
+                elif chat_id_of(update) in self.pending:
+                    # keep the order of the chat
+                    self.pending[chat_id_of(update)].append(item)
+                else:
+                    self.process(item)
+            finally:
+                self.queue.task_done()
+
+    def process(self, item: Item) -> bool:
+        """
+        Process the update, or defer it without waiting if the chat is out of the rate limit.
+        """
+        enqueued, update = item
+        chat_id = chat_id_of(update)
+        try:
+            wait = self.dispatcher.limiter.delay(chat_id)
+        except Exception:
+            logger.exception('Error on check rate limit')
+            wait = 0
+        if wait > 0:
+            self.defer(chat_id, [item], wait)
+            return False
+        try:
+            Dispatcher.process_update(self.dispatcher, update)
+        except Exception:
+            logger.exception('Error on process update')
+        finally:
+            close_old_connections()
+            self.record(time.monotonic() - enqueued)
+        return True
+
+    def defer(self, chat_id: int, items: List[Item], wait: float):
+        self.pending[chat_id] = items
+        with self.lock:
+            self.deferred += 1
+        # the timer thread may block on a full queue, but never the shard thread
+        timer = threading.Timer(wait, self.queue.put, ((time.monotonic(), Resume(chat_id)),))
+        timer.daemon = True
+        timer.start()
+
+    def resume(self, chat_id: int):
+        items = self.pending.pop(chat_id, [])
+        for i, item in enumerate(items):
+            if not self.process(item):
+                # deferred again, with the rest
+                self.pending[chat_id].extend(items[i + 1:])
+                return
+
+    def record(self, latency: float):
+        with self.lock:
+            self.processed += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def metrics(self, reset=False) -> dict:
+        """
+        Queue depth, and latency (from enqueue to finished) of updates since last reset.
+        """
+        with self.lock:
+            result = dict(
+                shard=self.index,
+                depth=self.queue.qsize(),
+                processed=self.processed,
+                deferred=self.deferred,
+                mean_latency=self.total_latency / self.processed if self.processed else 0.0,
+                max_latency=self.max_latency,
+            )
+            if reset:
+                self.processed = 0
+                self.deferred = 0
+                self.total_latency = 0.0
+                self.max_latency = 0.0
+        return result
+
+
+class ChatDispatcher(Dispatcher):
+    """
+    Process updates of different chats concurrently.
+
+    Updates are sharded by chat ID, one thread per shard, so the updates of one chat are still processed in order.
+    Updates of a chat out of the send rate limit are deferred, the other chats of the shard go on.
+    """
+    def __init__(self, bot, update_queue, shards=8, shard_queue_size=64, limiter=None, **kwargs):
+        super().__init__(bot, update_queue, **kwargs)
+        self.limiter = limiter or default_limiter
+        self.shards = [Shard(index, self, shard_queue_size) for index in range(shards)]
+        for shard in self.shards:
+            shard.thread.start()
+
+    def get_shard(self, update: telegram.Update) -> Shard:
+        return self.shards[chat_id_of(update) % len(self.shards)]
+
+    def process_update(self, update):
+        if not isinstance(update, telegram.Update):
+            return super().process_update(update)
+        # block when the shard is full, the pressure goes back to the update queue
+        self.get_shard(update).queue.put((time.monotonic(), update))
+
+    def metrics(self, reset=False) -> List[dict]:
+        return [shard.metrics(reset) for shard in self.shards]
+
+    def stop(self):
+        super().stop()
+        for shard in self.shards:
+            shard.queue.put(None)
+        for shard in self.shards:
+            shard.thread.join()
+
+
+def report_metrics(context: CallbackContext):
+    dispatcher = context.dispatcher
+    if not isinstance(dispatcher, ChatDispatcher):
+        return
+    metrics = dispatcher.metrics(reset=True)
+    for shard in metrics:
+        logger.info(
+            'shard %(shard)d: depth %(depth)d, processed %(processed)d, deferred %(deferred)d, '
+            'latency mean %(mean_latency).3fs max %(max_latency).3fs',
+            shard,
+        )
+    cache.set(METRICS_KEY, dict(time=time.time(), shards=metrics), 24 * 60 * 60)
+
+
+def get_metrics():
+    return cache.get(METRICS_KEY)
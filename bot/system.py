@@ -1,5 +1,8 @@
 import re
-from typing import Optional, List
+import threading
+from contextlib import contextmanager
+from collections import defaultdict
+from typing import Optional, List, Dict
 from uuid import uuid4
 
 import telegram
@@ -7,14 +10,20 @@ from telegram import Bot
 from telegram.ext import JobQueue
 from django.conf import settings
 from django.core.cache import cache
+from django.db.models import Q
 
 from archive.models import Chat, Log
+from archive.tasks import rebuild_export
 
 from entities import Me, Bold, Character, Span, Entities, Entity
 from .patterns import ME_REGEX, VARIABLE_REGEX
 from game.models import Player, Variable
+from game.cache import cached, bump_variable_version, version_key, variable_version_key
 
-bot = Bot(settings.BOT_TOKEN)
+bot = Bot(settings.BOT_TOKEN, base_url=settings.TELEGRAM_BASE_URL)
+
+MAX_SUBSTITUTION = 16
+MAX_EXPANDED_LENGTH = 256
 
 
 class Context:
@@ -43,61 +52,189 @@ def is_group_chat(chat: telegram.Chat) -> bool:
     return isinstance(chat, telegram.Chat) and chat.type in ('supergroup', 'group')
 
 
+class UpdateCache:
+    """
+    Memoize database lookups for the lifetime of one update.
+    """
+    def __init__(self):
+        self.chats: Dict[int, Chat] = {}
+        self.players: Dict[int, List[Player]] = {}
+        self.variables: Dict[int, Dict[str, str]] = {}
+        self.expanded_variables: Dict[int, Dict[str, str]] = {}
+
+
+_update_local = threading.local()
+
+
+@contextmanager
+def update_scope():
+    previous = current_update_cache()
+    _update_local.cache = UpdateCache()
+    try:
+        yield _update_local.cache
+    finally:
+        _update_local.cache = previous
+
+
+def current_update_cache() -> Optional[UpdateCache]:
+    return getattr(_update_local, 'cache', None)
+
+
 def is_gm(chat_id: int, user_id: int) -> bool:
-    player = Player.objects.filter(chat_id=chat_id, user_id=user_id).first()
+    player = get_player_by_id(chat_id, user_id)
     if not player:
         return False
     return player.is_gm
 
 
 def get_chat(telegram_chat: telegram.Chat) -> 'Chat':
+    update_cache = current_update_cache()
+    if update_cache and telegram_chat.id in update_cache.chats:
+        return update_cache.chats[telegram_chat.id]
     chat = Chat.objects.filter(
         chat_id=telegram_chat.id
     ).first()
-    if chat:
-        return chat
-    else:
-        return Chat.objects.create(
+    if not chat:
+        chat = Chat.objects.create(
             chat_id=telegram_chat.id,
             title=telegram_chat.title,
         )
+    if update_cache:
+        update_cache.chats[telegram_chat.id] = chat
+    return chat
 
 
 def is_author(message_id, user_id):
     return bool(Log.objects.filter(message_id=message_id, user_id=user_id).first())
 
 
+def load_players(chat_id) -> List[Player]:
+    return cached('players', lambda: list(Player.objects.filter(chat_id=chat_id).all()), version_key(chat_id))
+
+
+def get_players(chat_id) -> List[Player]:
+    update_cache = current_update_cache()
+    if not update_cache:
+        return load_players(chat_id)
+    if chat_id not in update_cache.players:
+        update_cache.players[chat_id] = load_players(chat_id)
+    return update_cache.players[chat_id]
+
+
 def get_player_by_username(chat_id, username: str) -> Optional[Player]:
     if username.startswith('@'):
         username = username[1:]
     if not username:
         return None
-    return Player.objects.filter(username=username, chat_id=chat_id).first()
+    for player in get_players(chat_id):
+        if player.username == username:
+            return player
+    return None
 
 
 def get_player_by_id(chat_id, user_id) -> Optional[Player]:
     if not user_id:
         return None
-    return Player.objects.filter(user_id=user_id, chat_id=chat_id).first()
+    for player in get_players(chat_id):
+        if player.user_id == user_id:
+            return player
+    return None
+
+
+def load_variables(player: Player) -> Dict[str, str]:
+    def load():
+        variables = {}
+        for variable in player.variable_set.all():
+            variables[variable.name.upper()] = variable.value
+        return variables
+    return cached('variables', load, variable_version_key(player.id))
+
+
+def get_variables(player: Player) -> Dict[str, str]:
+    """
+    Variables of the player, the key is the upper case name.
+    """
+    update_cache = current_update_cache()
+    if not update_cache:
+        return load_variables(player)
+    if player.id not in update_cache.variables:
+        update_cache.variables[player.id] = load_variables(player)
+    return update_cache.variables[player.id]
+
+
+def substitute_variables(text: str, variables: Dict[str, str]) -> str:
+    def replace(matched):
+        return variables.get(matched.group(1).upper(), matched.group(0))
+    return VARIABLE_REGEX.sub(replace, text, count=MAX_SUBSTITUTION)
+
+
+def expand_variables(variables: Dict[str, str]) -> Dict[str, str]:
+    """
+    Resolve the variables referenced in values, in dependency order.
+
+    References to a variable in or depending on a cycle are left as they are,
+    so are the values which would be longer than `MAX_EXPANDED_LENGTH`.
+    """
+    dependents = defaultdict(list)
+    pending = {}
+    for name, value in variables.items():
+        references = {matched.upper() for matched in VARIABLE_REGEX.findall(value)}
+        references = [reference for reference in references if reference in variables]
+        for reference in references:
+            dependents[reference].append(name)
+        pending[name] = len(references)
+
+    expanded = {}
+    ready = [name for name, count in pending.items() if count == 0]
+    while ready:
+        name = ready.pop()
+        value = substitute_variables(variables[name], expanded)
+        expanded[name] = value if len(value) <= MAX_EXPANDED_LENGTH else variables[name]
+        for dependent in dependents[name]:
+            pending[dependent] -= 1
+            if pending[dependent] == 0:
+                ready.append(dependent)
+
+    resolved = dict(expanded)
+    for name, value in variables.items():
+        if name not in resolved:
+            value = substitute_variables(value, resolved)
+            expanded[name] = value if len(value) <= MAX_EXPANDED_LENGTH else variables[name]
+    return expanded
+
+
+def load_expanded_variables(player: Player) -> Dict[str, str]:
+    return cached('expanded_variables', lambda: expand_variables(load_variables(player)),
+                  variable_version_key(player.id))
+
+
+def get_expanded_variables(player: Player) -> Dict[str, str]:
+    """
+    Like `get_variables`, but references in the values have been resolved.
+    """
+    update_cache = current_update_cache()
+    if not update_cache:
+        return load_expanded_variables(player)
+    if player.id not in update_cache.expanded_variables:
+        update_cache.expanded_variables[player.id] = load_expanded_variables(player)
+    return update_cache.expanded_variables[player.id]
 
 
 class RpgMessage:
-    me = None
-    variables = {}
     segments: List[Entity]
     entities: Entities
 
     def __init__(self, message: telegram.Message, start=0, temp_name=None):
         self.entities = Entities()
         self.start = start
-        self.players = list(Player.objects.filter(chat_id=message.chat_id).all())
-        for player in self.players:
-            if player.user_id == message.from_user.id:
-                self.me = Me(temp_name or player.character_name, player.id, player.full_name)
-                self.variables = {}
-                for variable in player.variable_set.all():
-                    self.variables[variable.name.upper()] = variable.value
-                break
+        self.chat_id = message.chat_id
+        self.user_id = message.from_user.id
+        self.temp_name = temp_name
+        self._player = None
+        self._player_loaded = False
+        self._variables = None
+        self.mentioned_by_username: Dict[str, Player] = {}
+        self.mentioned_by_id: Dict[int, Player] = {}
 
         self.tags = []
         if message.caption:
@@ -109,6 +246,7 @@ class RpgMessage:
         if not text:
             return
         assert isinstance(text, str)
+        self.load_mentioned(text, entities)
         last_index = 0
 
         for entity in entities:
@@ -142,18 +280,55 @@ class RpgMessage:
             else:
                 self.entities.list.pop(0)
 
-    def replace_variable(self, matched):
-        return self.variables.get(matched.group(1).upper(), matched.group(0))
+    @property
+    def player(self) -> Optional[Player]:
+        # only load the sender when the text has `.me` or variables
+        if not self._player_loaded:
+            self._player = get_player_by_id(self.chat_id, self.user_id)
+            self._player_loaded = True
+        return self._player
+
+    @property
+    def me(self) -> Optional[Me]:
+        player = self.player
+        if player is None:
+            return None
+        return Me(self.temp_name or player.character_name, player.id, player.full_name)
+
+    def load_mentioned(self, text: str, entities: List[telegram.MessageEntity]):
+        usernames = set()
+        user_id_set = set()
+        for entity in entities:
+            if entity.type == entity.MENTION:
+                usernames.add(text[entity.offset+1:entity.offset+entity.length])
+            elif entity.type == entity.TEXT_MENTION:
+                user_id_set.add(entity.user.id)
+        if not usernames and not user_id_set:
+            return
+        update_cache = current_update_cache()
+        if update_cache and self.chat_id in update_cache.players:
+            players = update_cache.players[self.chat_id]
+        else:
+            players = Player.objects.filter(
+                Q(username__in=usernames) | Q(user_id__in=user_id_set),
+                chat_id=self.chat_id,
+            )
+        for player in players:
+            if player.username in usernames:
+                self.mentioned_by_username[player.username] = player
+            if player.user_id in user_id_set:
+                self.mentioned_by_id[player.user_id] = player
+
+    @property
+    def variables(self) -> Dict[str, str]:
+        if self._variables is None:
+            self._variables = get_expanded_variables(self.player) if self.player else {}
+        return self._variables
 
     def resolve_variable(self, text: str):
-        counter = 16
-        text = VARIABLE_REGEX.sub(self.replace_variable, text, count=counter)
-        extra_resolve_level = 3
-        for _ in range(extra_resolve_level):
-            if len(text) > 256:
-                break
-            text = VARIABLE_REGEX.sub(self.replace_variable, text, count=counter)
-        return text
+        if not VARIABLE_REGEX.search(text):
+            return text
+        return substitute_variables(text, self.variables)
 
     def push_text(self, text: str):
         def push(x: str):
@@ -171,18 +346,17 @@ class RpgMessage:
 
     def push_mention(self, mention: str):
         username = mention[1:]  # skip @
-        for player in self.players:
-            if player.username == username:
-                character = Character(player.character_name, player.id, player.full_name)
-                return self.entities.list.append(character)
+        player = self.mentioned_by_username.get(username)
+        if player is not None:
+            character = Character(player.character_name, player.id, player.full_name)
+            return self.entities.list.append(character)
         return self.entities.list.append(Span(mention))
 
     def push_text_mention(self, user):
-        for player in self.players:
-            if player.user_id == user.id:
-                character = Character(player.character_name, player.id, player.full_name)
-                self.entities.list.append(character)
-                return
+        player = self.mentioned_by_id.get(user.id)
+        if player is not None:
+            character = Character(player.character_name, player.id, player.full_name)
+            self.entities.list.append(character)
 
     def has_me(self) -> bool:
         for segment in self.entities.list:
@@ -253,6 +427,14 @@ class Deletion:
                 bot.delete_message(self.chat_id, message_id)
             except telegram.TelegramError:
                 pass
-        Log.objects.filter(chat__chat_id=self.chat_id, message_id__in=self.message_list).delete()
+        if self.message_list:
+            Log.objects.filter(chat__chat_id=self.chat_id, message_id__in=self.message_list).delete()
+            for chat_id in Chat.objects.filter(chat_id=self.chat_id).values_list('id', flat=True):
+                rebuild_export(chat_id)
         if self.variable_id_list:
-            Variable.objects.filter(id__in=self.variable_id_list).delete()
+            variables = Variable.objects.filter(id__in=self.variable_id_list)
+            player_id_list = list(variables.values_list('player_id', flat=True).distinct())
+            variables.delete()
+            # after the delete, otherwise a reader may cache the variables again under the new version
+            for player_id in player_id_list:
+                bump_variable_version(player_id)
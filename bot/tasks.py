@@ -1,4 +1,7 @@
 import io
+import json
+import time
+import hashlib
 import uuid
 import logging
 from functools import partial
@@ -6,16 +9,63 @@ from functools import partial
 import telegram
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton, TelegramError
 from django.core.cache import cache
+from django_redis import get_redis_connection
 
 from archive.models import Log
+from archive.tasks import rebuild_export
 from bot.display import get, Text, get_by_user
 from bot.system import bot
+from bot.rate_limit import limiter
+from game import initiative
 from game.models import Round
 from play_trpg.celery import app
 
 
 logger = logging.getLogger(__name__)
 
+# sorted set of "chat_id:message_id", scored by the time to delete
+DELETION_QUEUE_KEY = 'deletion:queue'
+DELETION_BATCH_SIZE = 100
+
+EDIT_SEQUENCE_EXPIRE = 24 * 60 * 60
+
+# messages to send of each chat, in order, sent by one worker at a time
+SEND_QUEUE_EXPIRE = 24 * 60 * 60
+SEND_LOCK_TIMEOUT = 60
+
+# Round updates of a chat within this window are merged into one render
+ROUND_DEBOUNCE = 0.5
+ROUND_STATE_EXPIRE = 24 * 60 * 60
+
+
+def wait_for_rate_limit(task, chat_id):
+    wait = limiter.acquire(chat_id)
+    if wait > 0:
+        raise task.retry(countdown=wait, max_retries=None)
+
+
+def edit_sequence_key(kind, chat_id, message_id):
+    return 'edit:{}:{}:{}'.format(kind, chat_id, message_id)
+
+
+def next_edit_sequence(kind, chat_id, message_id) -> int:
+    key = edit_sequence_key(kind, chat_id, message_id)
+    pipeline = get_redis_connection().pipeline()
+    pipeline.incr(key)
+    pipeline.expire(key, EDIT_SEQUENCE_EXPIRE)
+    sequence, _ = pipeline.execute()
+    return sequence
+
+
+def is_superseded(kind, chat_id, message_id, sequence) -> bool:
+    """
+    A newer edit of the same message has been enqueued, this one is redundant.
+    """
+    if sequence is None:
+        return False
+    latest = get_redis_connection().get(edit_sequence_key(kind, chat_id, message_id))
+    return latest is not None and int(latest) > sequence
+
 
 @app.task
 def set_photo_task(log_id, file_id):
@@ -25,6 +75,7 @@ def set_photo_task(log_id, file_id):
     bot.get_file(file_id).download(out=media)
     media.close()
     log.save()
+    rebuild_export(log.chat_id)
 
 
 @app.task
@@ -34,21 +85,51 @@ def after_edit_delete_previous_message_task(log_id):
         return
     bot.delete_message(edit_log.chat.chat_id, message_id=edit_log.message_id)
     edit_log.delete()
+    rebuild_export(edit_log.chat_id)
 
 
 @app.task
 def delete_message_task(chat_id, message_id):
+    # only for tasks enqueued before the deletion queue
     try:
         bot.delete_message(chat_id, message_id)
     except telegram.error.BadRequest:
         pass
-    cache.delete(deletion_task_key(chat_id, message_id))
 
 
 @app.task
-def send_message_task(chat_id, text, reply_to=None, parse_mode='HTML', delete_after=None):
+def delete_due_messages_task():
+    """
+    Drain the due messages from the deletion queue, run periodically by celery beat.
+    """
+    redis = get_redis_connection()
+    while True:
+        due = redis.zrangebyscore(DELETION_QUEUE_KEY, '-inf', time.time(), start=0, num=DELETION_BATCH_SIZE)
+        if not due:
+            return
+        # claim members one by one, skip which are canceled or claimed by another worker
+        pipeline = redis.pipeline()
+        for member in due:
+            pipeline.zrem(DELETION_QUEUE_KEY, member)
+        claimed = [member for member, removed in zip(due, pipeline.execute()) if removed]
+        for member in claimed:
+            chat_id, message_id = map(int, member.decode().split(':'))
+            try:
+                bot.delete_message(chat_id, message_id)
+            except telegram.error.BadRequest:
+                pass
+            except telegram.error.TelegramError:
+                logger.exception('Error on delete message')
+
+
+@app.task(bind=True)
+def send_message_task(self, chat_id, text, reply_to=None, parse_mode='HTML', delete_after=None):
+    # only for tasks enqueued before the send queue
+    wait_for_rate_limit(self, chat_id)
     try:
         sent = bot.send_message(chat_id, text, parse_mode, disable_web_page_preview=True, reply_to_message_id=reply_to)
+    except telegram.error.RetryAfter as e:
+        raise self.retry(countdown=e.retry_after, max_retries=None)
     except telegram.error.TelegramError:
         logger.exception('Error on send message')
         return
@@ -56,9 +137,64 @@ def send_message_task(chat_id, text, reply_to=None, parse_mode='HTML', delete_af
         delete_message(chat_id, sent.message_id, delete_after)
 
 
-@app.task
-def edit_message_task(chat_id, message_id, text, parse_mode):
-    bot.edit_message_text(text, chat_id, message_id, parse_mode=parse_mode)
+def send_queue_key(chat_id):
+    return 'send:queue:{}'.format(chat_id)
+
+
+def send_queued(chat_id) -> float:
+    """
+    Send the queued messages of the chat from the head, return 0 when drained or the seconds to wait.
+    """
+    redis = get_redis_connection()
+    key = send_queue_key(chat_id)
+    while True:
+        item = redis.lindex(key, 0)
+        if item is None:
+            return 0
+        wait = limiter.acquire(chat_id)
+        if wait > 0:
+            return wait
+        message = json.loads(item)
+        sent = None
+        try:
+            sent = bot.send_message(chat_id, message['text'], message['parse_mode'], disable_web_page_preview=True,
+                                    reply_to_message_id=message['reply_to'])
+        except telegram.error.RetryAfter as e:
+            return e.retry_after
+        except telegram.error.TelegramError:
+            logger.exception('Error on send message')
+        redis.lpop(key)
+        delete_after = message['delete_after']
+        if sent and delete_after and delete_after > 0:
+            delete_message(chat_id, sent.message_id, delete_after)
+
+
+@app.task(bind=True)
+def send_queued_task(self, chat_id):
+    redis = get_redis_connection()
+    while redis.llen(send_queue_key(chat_id)):
+        lock = cache.lock('send:lock:{}'.format(chat_id), timeout=SEND_LOCK_TIMEOUT)
+        if not lock.acquire(blocking=False):
+            # the worker holding the lock sends them
+            return
+        try:
+            wait = send_queued(chat_id)
+        finally:
+            lock.release()
+        if wait > 0:
+            raise self.retry(countdown=wait, max_retries=None)
+        # check again, messages may be queued after drained and before the lock released
+
+
+@app.task(bind=True)
+def edit_message_task(self, chat_id, message_id, text, parse_mode, sequence=None):
+    if is_superseded('text', chat_id, message_id, sequence):
+        return
+    wait_for_rate_limit(self, chat_id)
+    try:
+        bot.edit_message_text(text, chat_id, message_id, parse_mode=parse_mode)
+    except telegram.error.RetryAfter as e:
+        raise self.retry(countdown=e.retry_after, max_retries=None)
 
 
 @app.task
@@ -66,23 +202,60 @@ def answer_callback_query_task(query_id, text, show_alert, cache_time):
     bot.answer_callback_query(query_id, text, show_alert, cache_time=cache_time)
 
 
-@app.task
-def edit_message_photo_task(chat_id, message_id, media_id):
+@app.task(bind=True)
+def edit_message_photo_task(self, chat_id, message_id, media_id):
+    wait_for_rate_limit(self, chat_id)
     media = telegram.InputMediaPhoto(media_id)
-    bot.edit_message_media(chat_id, message_id, media=media)
+    try:
+        bot.edit_message_media(chat_id, message_id, media=media)
+    except telegram.error.RetryAfter as e:
+        raise self.retry(countdown=e.retry_after, max_retries=None)
 
 
-@app.task
-def edit_message_caption_task(chat_id, message_id, text, parse_mode):
-    bot.edit_message_caption(chat_id, message_id, caption=text, parse_mode=parse_mode)
+@app.task(bind=True)
+def edit_message_caption_task(self, chat_id, message_id, text, parse_mode, sequence=None):
+    if is_superseded('caption', chat_id, message_id, sequence):
+        return
+    wait_for_rate_limit(self, chat_id)
+    try:
+        bot.edit_message_caption(chat_id, message_id, caption=text, parse_mode=parse_mode)
+    except telegram.error.RetryAfter as e:
+        raise self.retry(countdown=e.retry_after, max_retries=None)
 
 
-@app.task
-def update_round_message_task(chat_id, language_code, refresh):
+def round_key(name, chat_id):
+    return 'round:{}:{}'.format(name, chat_id)
+
+
+@app.task(bind=True)
+def update_round_message_task(self, chat_id, language_code, refresh, sequence=None):
     def get_text(t):
         return get(t, language_code)
 
-    game_round = Round.objects.get(chat_id=chat_id)
+    redis = get_redis_connection()
+    if sequence is not None:
+        pipeline = redis.pipeline()
+        pipeline.get(round_key('sequence', chat_id))
+        pipeline.get(round_key('resend', chat_id))
+        latest, resend = pipeline.execute()
+        if latest is not None and int(latest) > sequence:
+            # a newer update of this chat will render the latest state
+            return
+        if resend is not None:
+            redis.delete(round_key('resend', chat_id))
+            refresh = False
+
+    def wait_for_turn():
+        wait = limiter.acquire(chat_id)
+        if wait > 0:
+            if not refresh:
+                # put back the taken resend flag, for the retry or a newer update
+                redis.set(round_key('resend', chat_id), 1, ex=ROUND_STATE_EXPIRE)
+            raise self.retry(countdown=wait, max_retries=None)
+
+    game_round = initiative.get_state(chat_id)
+    if game_round is None:
+        return
     reply_markup = InlineKeyboardMarkup([
         [
             InlineKeyboardButton(get_text(Text.ROUND_REMOVE), callback_data='round:remove'),
@@ -92,11 +265,10 @@ def update_round_message_task(chat_id, language_code, refresh):
         ],
     ])
 
-    actors = game_round.get_actors()
+    actors = game_round.actors
     if not actors:
         return
-    game_round.counter = game_round.counter % len(actors)
-    counter = game_round.counter
+    counter = game_round.counter % len(actors)
     state = ''
     if game_round.hide:
         state = '[{}]'.format(get_text(Text.HIDED_ROUND_LIST))
@@ -108,14 +280,19 @@ def update_round_message_task(chat_id, language_code, refresh):
         counter=counter + 1,
         total=len(actors),
     )
-    for index, actor in enumerate(actors):
+    for index, (name, value) in enumerate(actors):
         is_current = counter == index
         if is_current:
-            text += '• {} ({}) ← {}\n'.format(actor.name, actor.value, get_text(Text.CURRENT))
+            text += '• {} ({}) ← {}\n'.format(name, value, get_text(Text.CURRENT))
         elif not game_round.hide:
-            text += '◦ {} ({})\n'.format(actor.name, actor.value)
+            text += '◦ {} ({})\n'.format(name, value)
 
+    digest = '{}:{}'.format(game_round.message_id, hashlib.sha1(text.encode()).hexdigest())
     if refresh:
+        rendered = redis.get(round_key('rendered', chat_id))
+        if rendered is not None and rendered.decode() == digest:
+            return
+        wait_for_turn()
         try:
             bot.edit_message_text(
                 text,
@@ -127,10 +304,27 @@ def update_round_message_task(chat_id, language_code, refresh):
         except TelegramError:
             pass
     else:
+        wait_for_turn()
         bot.delete_message(game_round.chat_id, game_round.message_id)
         message = bot.send_message(game_round.chat_id, text, parse_mode='HTML', reply_markup=reply_markup)
-        game_round.message_id = message.message_id
-        game_round.save()
+        Round.objects.filter(chat_id=chat_id).update(message_id=message.message_id)
+        initiative.set_field(chat_id, 'message_id', message.message_id)
+        digest = '{}:{}'.format(message.message_id, hashlib.sha1(text.encode()).hexdigest())
+    redis.set(round_key('rendered', chat_id), digest, ex=ROUND_STATE_EXPIRE)
+
+
+def schedule_round_message(chat_id, language_code, refresh=False):
+    """
+    Render the round indicator after a short delay, rapid updates of a chat only render the last state.
+    """
+    pipeline = get_redis_connection().pipeline()
+    pipeline.incr(round_key('sequence', chat_id))
+    pipeline.expire(round_key('sequence', chat_id), ROUND_STATE_EXPIRE)
+    if not refresh:
+        # resending the message must not be lost when merged into a later refresh
+        pipeline.set(round_key('resend', chat_id), 1, ex=ROUND_STATE_EXPIRE)
+    sequence = pipeline.execute()[0]
+    update_round_message_task.apply_async((chat_id, language_code, refresh, sequence), countdown=ROUND_DEBOUNCE)
 
 
 def answer_callback_query(query_id, text=None, show_alert=False, cache_time=0):
@@ -138,7 +332,8 @@ def answer_callback_query(query_id, text=None, show_alert=False, cache_time=0):
 
 
 def edit_message(chat_id, message_id, text, parse_mode='HTML'):
-    edit_message_task.delay(chat_id, message_id, text, parse_mode)
+    sequence = next_edit_sequence('text', chat_id, message_id)
+    edit_message_task.delay(chat_id, message_id, text, parse_mode, sequence)
 
 
 def edit_message_photo(chat_id, message_id, media_id):
@@ -146,36 +341,34 @@ def edit_message_photo(chat_id, message_id, media_id):
 
 
 def edit_message_caption(chat_id, message_id, text, parse_mode='HTML'):
-    edit_message_caption_task.delay(chat_id, message_id, text, parse_mode)
+    sequence = next_edit_sequence('caption', chat_id, message_id)
+    edit_message_caption_task.delay(chat_id, message_id, text, parse_mode, sequence)
 
 
 def send_message(chat_id, text, reply_to=None, parse_mode='HTML', delete_after=None):
-    send_message_task.delay(chat_id, text, reply_to, parse_mode, delete_after)
+    """
+    Queue the message, messages of a chat are sent in the order queued.
+    """
+    message = dict(text=text, reply_to=reply_to, parse_mode=parse_mode, delete_after=delete_after)
+    pipeline = get_redis_connection().pipeline()
+    pipeline.rpush(send_queue_key(chat_id), json.dumps(message))
+    pipeline.expire(send_queue_key(chat_id), SEND_QUEUE_EXPIRE)
+    pipeline.execute()
+    send_queued_task.delay(chat_id)
 
 
-def deletion_task_key(chat_id, message_id):
-    return 'deletion:{}:{}'.format(chat_id, message_id)
+def deletion_member(chat_id, message_id) -> str:
+    return '{}:{}'.format(chat_id, message_id)
 
 
 def delete_message(chat_id, message_id, when=0):
-    key = deletion_task_key(chat_id, message_id)
-    task_id = cache.get(key)
-    if task_id:
-        app.control.revoke(task_id)
-    if when > 0:
-        task = delete_message_task.apply_async((chat_id, message_id), countdown=when)
-        cache.set(key, task.id)
-    else:
-        delete_message_task.delay(chat_id, message_id)
+    # schedule again if already in the queue
+    due = time.time() + max(when, 0)
+    get_redis_connection().zadd(DELETION_QUEUE_KEY, {deletion_member(chat_id, message_id): due})
 
 
 def cancel_delete_message(chat_id, message_id):
-    key = deletion_task_key(chat_id, message_id)
-    task_id = cache.get(key)
-    if not task_id:
-        return
-    app.control.revoke(task_id)
-    cache.delete(key)
+    get_redis_connection().zrem(DELETION_QUEUE_KEY, deletion_member(chat_id, message_id))
 
 
 def after_edit_delete_previous_message(log_id):
@@ -1,7 +1,10 @@
 from functools import partial
-from typing import List
+from typing import List, Dict, Tuple
 
 import telegram
+from django.db import transaction
+from django.db.models.functions import Upper
+from django.utils import timezone
 
 from . import patterns
 from .display import get, Text, get_by_user
@@ -9,12 +12,14 @@ from .system import get_player_by_username,\
     get_player_by_id
 from bot.tasks import send_message, delete_message, error_message
 from game.models import Player, Variable
+from game.cache import bump_variable_version
 from archive.models import Log
 
 
 def handle_clear_variables(message: telegram.Message, player: Player, **_):
     _ = partial(get_by_user, user=message.from_user)
     player.variable_set.all().delete()
+    bump_variable_version(player.id)
     send_text = _(Text.VARIABLE_CLEARED).format(character=player.character_name)
     send_message(message.chat_id, send_text, delete_after=20)
     delete_message(message.chat_id, message.message_id)
@@ -45,6 +50,8 @@ class Assignment:
         self.player = player
         self.variable = variable
         self.old_value = old_value
+        # the same variable may be assigned again by a later line
+        self.value = variable.value
 
     def display(self, language_code: str):
         _ = partial(get, language_code=language_code)
@@ -53,14 +60,14 @@ class Assignment:
             character=character,
             variable=self.variable.name,
             old_value=self.old_value,
-            value=self.variable.value
+            value=self.value
         )
         if self.old_value is None:
-            if not self.variable.value:
+            if not self.value:
                 return _(Text.VARIABLE_ASSIGNED_EMPTY).format(**format_dict)
             else:
                 return _(Text.VARIABLE_ASSIGNED).format(**format_dict)
-        elif self.old_value == self.variable.value:
+        elif self.old_value == self.value:
             return _(Text.VARIABLE_NOT_CHANGE).format(**format_dict)
         else:
             return _(Text.VARIABLE_UPDATED).format(**format_dict)
@@ -79,6 +86,48 @@ def value_processing(text: str) -> str:
     return text.strip()
 
 
+def load_variables(player_list: List[Player], lines: List[str]) -> Dict[Tuple[int, str], Variable]:
+    """
+    Query the variables may be assigned by these lines at once, keyed by player id and upper case name.
+    """
+    names = set()
+    for line in lines:
+        line = line.strip()
+        matched = patterns.VARIABLE_MODIFY_REGEX.match(line)
+        if matched:
+            names.add(matched.group(1).upper())
+            continue
+        matched = patterns.VARIABLE_NAME_REGEX.search(line)
+        if matched:
+            names.add(matched.group(1).strip().upper())
+    if not names:
+        return {}
+    variables = {}
+    query = Variable.objects.annotate(upper_name=Upper('name')).filter(
+        player_id__in=[player.id for player in player_list],
+        upper_name__in=names,
+    ).order_by('-id')
+    for variable in query:
+        # keep the earliest one if there are duplicates
+        variables[(variable.player_id, variable.upper_name)] = variable
+    return variables
+
+
+def save_variables(player_list: List[Player], created: List[Variable], changed: List[Variable]):
+    if not created and not changed:
+        return
+    now = timezone.now()
+    for variable in changed:
+        variable.updated = now
+    with transaction.atomic():
+        # another `.set` may create the same variable meanwhile
+        Variable.objects.upsert(created)
+        Variable.objects.bulk_update(changed, ['value', 'updated'])
+        # bulk operations skip `Variable.save`
+        for player in player_list:
+            bump_variable_version(player.id)
+
+
 def handle_variable_assign(bot: telegram.Bot, message: telegram.Message, start: int,
                            player: Player, **_):
     _ = partial(get_by_user, user=message.from_user)
@@ -125,6 +174,25 @@ def handle_variable_assign(bot: telegram.Bot, message: telegram.Message, start:
     text = text[start:]
     assert isinstance(text, str)
     assignment_list = []
+    variables = load_variables(assign_player_list, text.splitlines())
+    created = []
+    changed = []
+
+    def get_variable(assign_player, var_name, value):
+        key = (assign_player.id, var_name.upper())
+        variable = variables.get(key)
+        if variable is not None:
+            return variable, variable.value
+        variable = Variable(player=assign_player, name=var_name, value=value)
+        variables[key] = variable
+        created.append(variable)
+        return variable, None
+
+    def set_value(variable, value):
+        variable.value = value
+        if variable.pk is not None and variable not in changed:
+            changed.append(variable)
+
     for line in text.splitlines():
         line = line.strip()
         # .set $VARIABLE + 42
@@ -134,22 +202,17 @@ def handle_variable_assign(bot: telegram.Bot, message: telegram.Message, start:
             operator = matched.group(2)
             value = value_processing(line[matched.end():])
             for assign_player in assign_player_list:
-                variable = Variable.objects.filter(player=assign_player, name__iexact=var_name).first()
-                if not variable:
-                    variable = Variable.objects.create(player=assign_player, name=var_name, value=value)
-                    old_value = None
-                else:
-                    old_value = variable.value
+                variable, old_value = get_variable(assign_player, var_name, value)
+                if old_value is not None:
                     if old_value.isdigit() and value.isdigit() and len(old_value) < 6 and len(value) < 6:
                         if operator == '+':
-                            variable.value = str(int(old_value) + int(value))
+                            set_value(variable, str(int(old_value) + int(value)))
                         elif operator == '-':
-                            variable.value = str(int(old_value) - int(value))
+                            set_value(variable, str(int(old_value) - int(value)))
                     elif operator == '+':
-                        variable.value = old_value + ', ' + value
+                        set_value(variable, old_value + ', ' + value)
                     else:
                         continue
-                variable.save()
                 assignment_list.append(Assignment(assign_player, variable, old_value))
         else:
             matched = patterns.VARIABLE_NAME_REGEX.search(line)
@@ -158,16 +221,12 @@ def handle_variable_assign(bot: telegram.Bot, message: telegram.Message, start:
             var_name = matched.group(1).strip()
             value = value_processing(line[matched.end():])
             for assign_player in assign_player_list:
-                variable = Variable.objects.filter(player=assign_player, name__iexact=var_name).first()
-                old_value = None
-                if not variable:
-                    variable = Variable.objects.create(player=assign_player, name=var_name, value=value)
-                else:
-                    old_value = variable.value
-                    variable.value = value
-                    variable.save()
+                variable, old_value = get_variable(assign_player, var_name, value)
+                if old_value is not None:
+                    set_value(variable, value)
                 assignment_list.append(Assignment(assign_player, variable, old_value))
 
+    save_variables(assign_player_list, created, changed)
     if len(assignment_list) == 0:
         return error_message(message, _(Text.VARIABLE_ASSIGN_USAGE))
     variable_message(message, assignment_list)
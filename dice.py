@@ -1,6 +1,13 @@
+import os
+import sys
 import secrets
 import enum
 import typing
+from array import array
+from collections import Counter
+from fractions import Fraction
+from functools import lru_cache
+from math import gcd
 
 from pypeg2 import *
 from entities import Entity, RollResult, Span
@@ -9,6 +16,7 @@ from entities import Entity, RollResult, Span
 class DiceErrorKind(enum.Enum):
     ZERO_DIVISION = 'ZERO_DIVISION'
     ROLL_SYNTAX_ERROR = 'ROLL_SYNTAX_ERROR'
+    TOO_COMPLEX = 'TOO_COMPLEX'
 
 
 class RollError(RuntimeError):
@@ -26,6 +34,9 @@ class Number(Symbol):
     def eval(self, *_args):
         return int(self.name), self.name
 
+    def distribution(self, *_args) -> 'Distribution':
+        return {int(self.name): Fraction(1)}
+
 
 class Operator(Symbol):
     display = ''
@@ -54,10 +65,123 @@ class Div(Operator):
 operator = [Add, Sub, Mul, Div]
 
 
+MAX_DISPLAY_DICE = 16
+
+# value -> probability
+Distribution = typing.Dict[int, Fraction]
+
+# limit of outcomes when computing a distribution
+MAX_OUTCOMES = 4096
+# limit of dice * faces of max / min, the powers get long with many dice
+MAX_EXTREMUM_COST = 16 * MAX_OUTCOMES
+
+
+def convolve(a: typing.Tuple[int, ...], b: typing.Tuple[int, ...]) -> typing.Tuple[int, ...]:
+    if len(a) * len(b) > MAX_OUTCOMES * MAX_OUTCOMES:
+        raise RollError(DiceErrorKind.TOO_COMPLEX)
+    result = [0] * (len(a) + len(b) - 1)
+    for i, x in enumerate(a):
+        for j, y in enumerate(b):
+            result[i + j] += x * y
+    return tuple(result)
+
+
+@lru_cache(maxsize=256)
+def sum_ways(counter: int, face: int) -> typing.Tuple[int, ...]:
+    """
+    Number of ways to roll each sum from `counter` to `counter * face`.
+    """
+    if counter * (face - 1) + 1 > MAX_OUTCOMES:
+        raise RollError(DiceErrorKind.TOO_COMPLEX)
+    if counter == 1:
+        return (1,) * face
+    half = counter // 2
+    return convolve(sum_ways(half, face), sum_ways(counter - half, face))
+
+
+@lru_cache(maxsize=256)
+def extremum_distribution(counter: int, face: int, maximum: bool) -> typing.Tuple[typing.Tuple[int, Fraction], ...]:
+    """
+    Order statistics, P(max = k) = (k^n - (k-1)^n) / f^n
+    """
+    if counter * face > MAX_EXTREMUM_COST:
+        raise RollError(DiceErrorKind.TOO_COMPLEX)
+    total = face ** counter
+    result = []
+    for k in range(1, face + 1):
+        below = k if maximum else face - k + 1
+        ways = below ** counter - (below - 1) ** counter
+        if ways:
+            result.append((k, Fraction(ways, total)))
+    return tuple(result)
+
+
+def combine(a: Distribution, b: Distribution, function) -> Distribution:
+    # every pair costs Fraction arithmetic, only for `*` and `/`
+    if len(a) * len(b) > MAX_OUTCOMES:
+        raise RollError(DiceErrorKind.TOO_COMPLEX)
+    result = {}
+    for x, p in a.items():
+        for y, q in b.items():
+            value = function(x, y)
+            result[value] = result.get(value, 0) + p * q
+    return result
+
+
+def to_weights(a: Distribution) -> typing.Tuple[int, typing.Tuple[int, ...], int]:
+    """
+    (minimum value, integer weights of the values from the minimum, denominator of the weights)
+    """
+    denominator = 1
+    for p in a.values():
+        denominator = denominator * p.denominator // gcd(denominator, p.denominator)
+    low = min(a)
+    weights = [0] * (max(a) - low + 1)
+    for x, p in a.items():
+        weights[x - low] = p.numerator * (denominator // p.denominator)
+    return low, tuple(weights), denominator
+
+
+def add(a: Distribution, b: Distribution, negate=False) -> Distribution:
+    """
+    Distribution of a + b, or a - b if `negate`, by integer convolution like `sum_ways`.
+    """
+    if negate:
+        b = {-y: q for y, q in b.items()}
+    if (max(a) - min(a)) + (max(b) - min(b)) + 1 > MAX_OUTCOMES:
+        # sparse values, e.g. 1d6*1000+1d6*1000
+        return combine(a, b, lambda x, y: x + y)
+    low_a, weights_a, denominator_a = to_weights(a)
+    low_b, weights_b, denominator_b = to_weights(b)
+    total = denominator_a * denominator_b
+    ways = convolve(weights_a, weights_b)
+    return {low_a + low_b + i: Fraction(w, total) for i, w in enumerate(ways) if w}
+
+
+def roll_sum(counter: int, face: int) -> int:
+    """
+    Sum of dice, all dice are drawn from one buffer of random bytes instead of a list of numbers.
+    """
+    if face > 0x10000:
+        return sum(secrets.randbelow(face) + 1 for _ in range(counter))
+    size = 1 if face <= 0x100 else 2
+    # reject values out of the limit, keep the result uniform
+    limit = (0x100 ** size // face) * face
+    total = 0
+    while counter > 0:
+        buffer = secrets.token_bytes(counter * size)
+        values = buffer if size == 1 else array('H', buffer)
+        for value, value_counter in Counter(values).items():
+            if value < limit:
+                total += (value % face + 1) * value_counter
+                counter -= value_counter
+    return total
+
+
 class Dice(Symbol):
     regex = re.compile(r'\d{0,4}[dD]\d{0,4}')
 
-    def eval(self, env: Env, result_sum=True):
+    def counter_and_face(self, env: Env) -> typing.Tuple[int, int]:
         match = self.name.split('d')
         try:
             counter = int(match[0])
@@ -67,14 +191,30 @@ class Dice(Symbol):
             face = int(match[1])
         except:
             face = env.face
+        return counter, face
+
+    def distribution(self, env: Env) -> Distribution:
+        counter, face = self.counter_and_face(env)
+        if face == 0 or counter == 0:
+            return {0: Fraction(1)}
+        elif face == 1:
+            return {counter: Fraction(1)}
+        total = face ** counter
+        return {counter + i: Fraction(ways, total) for i, ways in enumerate(sum_ways(counter, face))}
+
+    def eval(self, env: Env, result_sum=True):
+        counter, face = self.counter_and_face(env)
 
         if face == 0 or counter == 0:
             result = [0]
+        elif result_sum and counter > MAX_DISPLAY_DICE:
+            result = roll_sum(counter, face)
+            return result, '{}d{}={{...}}={}'.format(counter, face, result)
         elif face == 1:
             result = [1 for _ in range(counter)]
         else:
             result = [secrets.randbelow(face) + 1 for _ in range(counter)]
-        if len(result) > 16:
+        if len(result) > MAX_DISPLAY_DICE:
             result_text = '={...}'
         elif counter < 2:
             result_text = ''
@@ -99,6 +239,12 @@ class Max:
         result = max(value)
         return result, 'max {}'.format(text, result)
 
+    def distribution(self, env) -> Distribution:
+        counter, face = self.dice.counter_and_face(env)
+        if face == 0 or counter == 0:
+            return {0: Fraction(1)}
+        return dict(extremum_distribution(counter, face, True))
+
 
 class Min:
     dice = None
@@ -112,6 +258,12 @@ class Min:
         result = min(value)
         return result, 'min {}'.format(text, min(value))
 
+    def distribution(self, env) -> Distribution:
+        counter, face = self.dice.counter_and_face(env)
+        if face == 0 or counter == 0:
+            return {0: Fraction(1)}
+        return dict(extremum_distribution(counter, face, False))
+
 
 # left recursion!
 # https://bitbucket.org/fdik/pypeg/issues/4/
@@ -150,16 +302,47 @@ class Expr(List):
                 result -= value_list[i + 1]
         return result, '[{}]={}'.format(' '.join(show_list), result)
 
+    def distribution(self, env) -> Distribution:
+        value_list = [i if isinstance(i, Operator) else i.distribution(env) for i in self]
+
+        def divide(a, b):
+            if b == 0:
+                raise RollError(DiceErrorKind.ZERO_DIVISION)
+            return a // b
+
+        for i, current in enumerate(value_list):
+            if isinstance(current, (Mul, Div)):
+                a = value_list[i - 1]
+                b = value_list[i + 1]
+                if isinstance(current, Mul):
+                    value_list[i + 1] = combine(a, b, lambda x, y: x * y)
+                else:
+                    value_list[i + 1] = combine(a, b, divide)
+                value_list[i] = None
+                value_list[i - 1] = None
+        value_list = list(filter(lambda x: x is not None, value_list))
+        result = value_list[0]
+        for i, current in enumerate(value_list):
+            if isinstance(current, Add):
+                result = add(result, value_list[i + 1])
+            elif isinstance(current, Sub):
+                result = add(result, value_list[i + 1], negate=True)
+        return result
+
 
 item = [Dice, Number, Max, Min, ('(', Expr, ')')]
 Expr.grammar = (item, maybe_some(operator, item))
 
 
+TEXT_REGEX = re.compile(r'[^。.；，,、…！!？/ ⧸⁄—-【】“”"（）()：:\[\]{}<>《》〔〕『』‘’「」\s]+')
+PUNCTUATION_REGEX = re.compile(r'[。.；，,、…！!？/ ⧸⁄—-【】“”"（）()：:\[\]{}<>《》〔〕『』‘’「」]+')
+
+
 class Roll(List):
     grammar = maybe_some([
         Expr,
-        re.compile(r'[^。.；，,、…！!？/ ⧸⁄—-【】“”"（）()：:\[\]{}<>《》〔〕『』‘’「」\s]+'),
-        re.compile(r'[。.；，,、…！!？/ ⧸⁄—-【】“”"（）()：:\[\]{}<>《》〔〕『』‘’「」]+'),
+        TEXT_REGEX,
+        PUNCTUATION_REGEX,
     ])
 
     def eval_entities(self, env) -> typing.List[Entity]:
@@ -190,20 +373,241 @@ class Roll(List):
             result_text.insert(0, '<code>{}</code>'.format(text))
         return result_value, ' '.join(result_text)
 
-
-def roll_entities(text, default_dice_face) -> typing.List[Entity]:
-    env = Env(face=default_dice_face)
+    def distribution(self, env) -> Distribution:
+        """
+        Distribution of the roll result, which is the last expression as `eval` does.
+        """
+        for e in reversed(self):
+            if not isinstance(e, str):
+                return e.distribution(env)
+        return parse('1d', Dice).distribution(env)
+
+
+WHITESPACE_REGEX = re.compile(r'\s+')
+MAX_KEYWORDS = ('最大', 'max', 'MAX', 'Max')
+MIN_KEYWORDS = ('最小', 'min', 'Min', 'MIN')
+BRACKETS = (('(', ')'), ('（', '）'))
+
+# Parse roll with the old pypeg2 grammar, for compare with the new parser.
+LEGACY_PARSER = bool(os.getenv('DICE_LEGACY_PARSER', False))
+
+
+class Parser:
+    """
+    Single pass recursive descent parser which produce the same AST as the pypeg2 grammar.
+
+    Operator precedence is left to `Expr.eval`, so the displayed text stays the same.
+    """
+    def __init__(self, text: str):
+        self.text = text
+        self.expr_memo = {}
+
+    def skip(self, pos: int) -> int:
+        matched = WHITESPACE_REGEX.match(self.text, pos)
+        if matched:
+            return matched.end()
+        return pos
+
+    def literal(self, literal: str, pos: int) -> typing.Optional[int]:
+        if self.text.startswith(literal, pos):
+            return self.skip(pos + len(literal))
+        return None
+
+    def symbol(self, symbol_type, pos: int):
+        matched = symbol_type.regex.match(self.text, pos)
+        if not matched:
+            return None
+        return symbol_type(matched.group(0)), self.skip(matched.end())
+
+    def extremum(self, extremum_type, keywords, pos: int):
+        for keyword in keywords:
+            after_keyword = self.literal(keyword, pos)
+            if after_keyword is not None:
+                break
+        else:
+            return None
+        node = extremum_type()
+        for left, right in BRACKETS:
+            after_left = self.literal(left, after_keyword)
+            if after_left is None:
+                continue
+            parsed = self.symbol(Dice, after_left)
+            if not parsed:
+                continue
+            node.dice, after_dice = parsed
+            after_right = self.literal(right, after_dice)
+            if after_right is not None:
+                return node, after_right
+        parsed = self.symbol(Dice, after_keyword)
+        if not parsed:
+            return None
+        node.dice, pos = parsed
+        return node, pos
+
+    def item(self, pos: int):
+        parsed = (self.symbol(Dice, pos) or self.symbol(Number, pos)
+                  or self.extremum(Max, MAX_KEYWORDS, pos) or self.extremum(Min, MIN_KEYWORDS, pos))
+        if parsed:
+            return parsed
+        after_left = self.literal('(', pos)
+        if after_left is None:
+            return None
+        parsed = self.expr(after_left)
+        if not parsed:
+            return None
+        node, pos = parsed
+        after_right = self.literal(')', pos)
+        if after_right is None:
+            return None
+        return node, after_right
+
+    def expr(self, pos: int):
+        if pos not in self.expr_memo:
+            self.expr_memo[pos] = self._expr(pos)
+        return self.expr_memo[pos]
+
+    def _expr(self, pos: int):
+        parsed = self.item(pos)
+        if not parsed:
+            return None
+        node, pos = parsed
+        items = [node]
+        while True:
+            parsed_operator = None
+            for operator_type in operator:
+                parsed_operator = self.symbol(operator_type, pos)
+                if parsed_operator:
+                    break
+            if not parsed_operator:
+                break
+            operator_node, after_operator = parsed_operator
+            parsed = self.item(after_operator)
+            if not parsed:
+                break
+            node, pos = parsed
+            items.extend((operator_node, node))
+        return Expr(items), pos
+
+    def roll(self) -> Roll:
+        items = []
+        pos = self.skip(0)
+        while pos < len(self.text):
+            parsed = self.expr(pos)
+            if parsed:
+                node, pos = parsed
+            else:
+                matched = TEXT_REGEX.match(self.text, pos) or PUNCTUATION_REGEX.match(self.text, pos)
+                if not matched:
+                    raise RollError(DiceErrorKind.ROLL_SYNTAX_ERROR)
+                node = matched.group(0)
+                pos = self.skip(matched.end())
+            items.append(node)
+        return Roll(items)
+
+
+def parse_roll(text: str, legacy=None) -> Roll:
+    if legacy is None:
+        legacy = LEGACY_PARSER
     try:
-        roll_ast = parse(text, Roll)
-    except SyntaxError:
+        if legacy:
+            return parse(text, Roll)
+        return Parser(text).roll()
+    except (SyntaxError, RecursionError):
         raise RollError(DiceErrorKind.ROLL_SYNTAX_ERROR)
+
+
+PARSE_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _compile(text: str, default_dice_face: int) -> typing.Tuple[Roll, Env]:
+    return parse_roll(text), Env(face=default_dice_face)
+
+
+def compile_roll(text: str, default_dice_face: int) -> typing.Tuple[Roll, Env]:
+    """
+    Parse roll expression, the parsed result will be cached.
+
+    Evaluating the AST does not mutate it, so the cached one only re-run the random part.
+    """
+    return _compile(text.strip(), default_dice_face)
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _distribution(text: str, default_dice_face: int) -> typing.Tuple[typing.Tuple[int, Fraction], ...]:
+    roll_ast, env = compile_roll(text, default_dice_face)
+    return tuple(sorted(roll_ast.distribution(env).items()))
+
+
+def distribution(text: str, default_dice_face: int) -> Distribution:
+    """
+    Exact distribution of the roll result.
+
+    >>> distribution('2d6+3', 20)[15]
+    Fraction(1, 36)
+    """
+    return dict(_distribution(text.strip(), default_dice_face))
+
+
+def probability(text: str, default_dice_face: int, predicate) -> Fraction:
+    """
+    Probability of the roll result satisfy the predicate.
+
+    >>> probability('2d6+3', 20, lambda x: x >= 10)
+    Fraction(7, 12)
+    """
+    return sum((p for value, p in _distribution(text.strip(), default_dice_face) if predicate(value)), Fraction(0))
+
+
+def cache_info():
+    """
+    Hits and misses of the parse cache.
+    """
+    return _compile.cache_info()
+
+
+def roll_entities(text, default_dice_face) -> typing.List[Entity]:
+    roll_ast, env = compile_roll(text, default_dice_face)
     return roll_ast.eval_entities(env)
 
 
 def roll(text, default_dice_face):
-    env = Env(face=default_dice_face)
-    try:
-        roll_ast = parse(text, Roll)
-    except SyntaxError:
-        raise RollError(DiceErrorKind.ROLL_SYNTAX_ERROR)
+    roll_ast, env = compile_roll(text, default_dice_face)
     return roll_ast.eval(env)
+
+
+def dump(node) -> str:
+    """
+    Structural representation of AST, used for compare parsers.
+    """
+    if isinstance(node, (Max, Min)):
+        return '{}({})'.format(type(node).__name__, dump(node.dice))
+    elif isinstance(node, List):
+        return '{}[{}]'.format(type(node).__name__, ', '.join(map(dump, node)))
+    return repr(node)
+
+
+def compare_parsers(corpus: typing.Iterable[str]):
+    """
+    Yield the texts which parsed differently by the pypeg2 grammar and the new parser.
+    """
+    for text in corpus:
+        try:
+            legacy = dump(parse_roll(text, legacy=True))
+        except RollError as e:
+            legacy = repr(e)
+        try:
+            current = dump(parse_roll(text, legacy=False))
+        except RollError as e:
+            current = repr(e)
+        if legacy != current:
+            yield text, legacy, current
+
+
+if __name__ == '__main__':
+    # python dice.py < rolls.txt
+    mismatched = 0
+    for line, legacy_ast, current_ast in compare_parsers(line.rstrip('\n') for line in sys.stdin):
+        mismatched += 1
+        print('{!r}\n  legacy: {}\n  current: {}'.format(line, legacy_ast, current_ast))
+    sys.exit(1 if mismatched else 0)
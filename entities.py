@@ -1,5 +1,5 @@
 import re
-from typing import List, Optional
+from typing import List, Optional, Dict, Type
 
 
 def escape(text: str) -> str:
@@ -10,13 +10,12 @@ def escape(text: str) -> str:
 
 
 class Entity:
+    __slots__ = ()
     kind = 'none'
     value = None
 
     def object(self) -> dict:
-        obj = self.__dict__
-        obj['kind'] = self.kind
-        return obj
+        return {'kind': self.kind}
 
     def telegram_html(self):
         return ''
@@ -53,11 +52,15 @@ class Entities:
 
 
 class Span(Entity):
+    __slots__ = ('value',)
     kind = 'span'
 
     def __init__(self, text):
         self.value = text
 
+    def object(self) -> dict:
+        return {'value': self.value, 'kind': self.kind}
+
     def telegram_html(self):
         return escape(self.value)
 
@@ -67,6 +70,7 @@ class Span(Entity):
 
 
 class Character(Entity):
+    __slots__ = ('value', 'player_id', 'full_name')
     kind = 'character'
 
     def __init__(self, character: str, player_id: int, full_name: str):
@@ -74,6 +78,9 @@ class Character(Entity):
         self.player_id = player_id
         self.full_name = full_name
 
+    def object(self) -> dict:
+        return {'value': self.value, 'player_id': self.player_id, 'full_name': self.full_name, 'kind': self.kind}
+
     def telegram_html(self):
         return '<b>{}</b>'.format(escape(self.value))
 
@@ -83,6 +90,7 @@ class Character(Entity):
 
 
 class Me(Character):
+    __slots__ = ()
     kind = 'me'
 
     @staticmethod
@@ -91,11 +99,15 @@ class Me(Character):
 
 
 class Bold(Entity):
+    __slots__ = ('value',)
     kind = 'bold'
 
     def __init__(self, text):
         self.value = text
 
+    def object(self) -> dict:
+        return {'value': self.value, 'kind': self.kind}
+
     def telegram_html(self):
         return '<b>{}</b>'.format(escape(self.value))
 
@@ -105,11 +117,15 @@ class Bold(Entity):
 
 
 class Code(Entity):
+    __slots__ = ('value',)
     kind = 'code'
 
     def __init__(self, text):
         self.value = text
 
+    def object(self) -> dict:
+        return {'value': self.value, 'kind': self.kind}
+
     def telegram_html(self):
         return '<code>{}</code>'.format(escape(self.value))
 
@@ -119,12 +135,16 @@ class Code(Entity):
 
 
 class RollResult(Entity):
+    __slots__ = ('value', 'result')
     kind = 'roll'
 
     def __init__(self, text, result=None):
         self.value = text
         self.result = result
 
+    def object(self) -> dict:
+        return {'value': self.value, 'result': self.result, 'kind': self.kind}
+
     def telegram_html(self):
         return ' <code>{}</code> '.format(escape(self.value))
 
@@ -134,11 +154,15 @@ class RollResult(Entity):
 
 
 class LoopResult(Entity):
+    __slots__ = ('rolled',)
     kind = 'loop-roll'
 
     def __init__(self, rolled: List[int]):
         self.rolled = rolled
 
+    def object(self) -> dict:
+        return {'rolled': self.rolled, 'kind': self.kind}
+
     def telegram_html(self):
         counter_6 = self.rolled.count(6)
         counter_all = len(self.rolled)
@@ -151,6 +175,7 @@ class LoopResult(Entity):
 
 
 class CocResult(Entity):
+    __slots__ = ('rolled', 'level', 'modifier_name', 'rolled_list', 'value')
     kind = 'coc-roll'
 
     def __init__(self, rolled: int, level: str,
@@ -162,6 +187,16 @@ class CocResult(Entity):
 
         self.value = level
 
+    def object(self) -> dict:
+        return dict(
+            rolled=self.rolled,
+            level=self.level,
+            modifier_name=self.modifier_name,
+            rolled_list=self.rolled_list,
+            value=self.value,
+            kind=self.kind,
+        )
+
     def telegram_html(self):
         result = '<code>{rolled}</code> {level}'.format(
             rolled=self.rolled, level=self.level,
@@ -216,10 +251,14 @@ def make_entities_object(entities: List[Entity]):
     return list([entity.object() for entity in entities])
 
 
+ENTITY_KINDS: Dict[str, Type[Entity]] = {
+    E.kind: E for E in (Span, Character, Me, Bold, Code, RollResult, LoopResult, CocResult)
+}
+
+
 def object_to_entity(obj: dict) -> Optional[Entity]:
-    kind = obj.get('kind', '')
-    for E in (Span, Character, Me, Bold, Code, RollResult, LoopResult, CocResult):
-        if E.kind == kind:
-            return E.from_object(obj)
-    return None
+    E = ENTITY_KINDS.get(obj.get('kind', ''))
+    if E is None:
+        return None
+    return E.from_object(obj)
 
@@ -0,0 +1,65 @@
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+from django_redis import get_redis_connection
+
+CACHE_TTL = 24 * 60 * 60
+
+HIT_KEY = 'game:cache:hit'
+MISS_KEY = 'game:cache:miss'
+
+
+def version_key(chat_id) -> str:
+    return 'game:version:{}'.format(chat_id)
+
+
+def variable_version_key(player_id) -> str:
+    # by player id, which `Variable` has without loading the player
+    return 'game:version:player:{}'.format(player_id)
+
+
+def get_version(key: str) -> str:
+    version = cache.get(key)
+    if version is None:
+        # a new version never collides with the entries cached before
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate(*keys):
+    # bump after commit, otherwise a reader may cache the rows before this transaction
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def bump_player_version(chat_id):
+    invalidate(version_key(chat_id))
+
+
+def bump_variable_version(player_id):
+    invalidate(variable_version_key(player_id))
+
+
+def cached(name: str, load, key: str):
+    """
+    Get value from cache which keyed by the version `key`, call `load` when missing.
+    """
+    value_key = 'game:{}:{}:{}'.format(name, key, get_version(key))
+    value = cache.get(value_key)
+    if value is None:
+        get_redis_connection().incr(MISS_KEY)
+        value = load()
+        cache.set(value_key, value, CACHE_TTL)
+    else:
+        get_redis_connection().incr(HIT_KEY)
+    return value
+
+
+def stats():
+    hit, miss = get_redis_connection().mget(HIT_KEY, MISS_KEY)
+    return int(hit or 0), int(miss or 0)
+
+
+def reset_stats():
+    get_redis_connection().delete(HIT_KEY, MISS_KEY)
@@ -0,0 +1,238 @@
+from typing import List, Optional, Tuple, NamedTuple
+
+from django_redis import get_redis_connection
+
+from game.models import Round, Actor
+
+# Round state kept in Redis, Postgres only receives snapshots of it
+STATE_EXPIRE = 7 * 24 * 60 * 60
+DIRTY_KEY = 'initiative:dirty'
+FLUSH_BATCH_SIZE = 200
+
+ALREADY_FIRST = -1
+
+# KEYS: state, actors, names; ARGV: expire, counter, round_counter, hide, message_id, then id, value, name of actors
+LOAD_SCRIPT = '''
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('DEL', KEYS[2], KEYS[3])
+redis.call('HSET', KEYS[1], 'counter', ARGV[2], 'round_counter', ARGV[3], 'hide', ARGV[4], 'message_id', ARGV[5])
+for i = 6, #ARGV, 3 do
+    redis.call('ZADD', KEYS[2], ARGV[i + 1], ARGV[i])
+    redis.call('HSET', KEYS[3], ARGV[i], ARGV[i + 2])
+end
+for i = 1, 3 do
+    redis.call('EXPIRE', KEYS[i], ARGV[1])
+end
+return 1
+'''
+
+# KEYS: state, actors, names, dirty; ARGV: expire, chat_id
+NEXT_SCRIPT = '''
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+local total = redis.call('ZCARD', KEYS[2])
+local counter = tonumber(redis.call('HGET', KEYS[1], 'counter')) + 1
+local round_counter = tonumber(redis.call('HGET', KEYS[1], 'round_counter'))
+if counter >= total then
+    counter = 0
+    round_counter = round_counter + 1
+end
+redis.call('HSET', KEYS[1], 'counter', counter, 'round_counter', round_counter)
+redis.call('SADD', KEYS[4], ARGV[2])
+for i = 1, 3 do
+    redis.call('EXPIRE', KEYS[i], ARGV[1])
+end
+return {counter, round_counter}
+'''
+
+PREV_SCRIPT = '''
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+local total = redis.call('ZCARD', KEYS[2])
+local counter = tonumber(redis.call('HGET', KEYS[1], 'counter')) - 1
+local round_counter = tonumber(redis.call('HGET', KEYS[1], 'round_counter'))
+if counter < 0 then
+    if round_counter <= 1 then
+        return {-1, round_counter}
+    end
+    counter = total - 1
+    round_counter = round_counter - 1
+end
+redis.call('HSET', KEYS[1], 'counter', counter, 'round_counter', round_counter)
+redis.call('SADD', KEYS[4], ARGV[2])
+for i = 1, 3 do
+    redis.call('EXPIRE', KEYS[i], ARGV[1])
+end
+return {counter, round_counter}
+'''
+
+# remove the current actor unless it is the last one, return its id
+REMOVE_CURRENT_SCRIPT = '''
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+local total = redis.call('ZCARD', KEYS[2])
+if total <= 1 then
+    return 0
+end
+local counter = tonumber(redis.call('HGET', KEYS[1], 'counter')) % total
+local current = redis.call('ZREVRANGE', KEYS[2], counter, counter)[1]
+redis.call('ZREM', KEYS[2], current)
+redis.call('HDEL', KEYS[3], current)
+return current
+'''
+
+
+class RoundState(NamedTuple):
+    chat_id: int
+    counter: int
+    round_counter: int
+    hide: bool
+    message_id: int
+    # (name, value) ordered by value descending
+    actors: List[Tuple[str, int]]
+
+
+def state_keys(chat_id) -> List[str]:
+    key = 'initiative:{}'.format(chat_id)
+    return [key, key + ':actors', key + ':names']
+
+
+def script(source: str):
+    redis = get_redis_connection()
+    return redis.register_script(source)
+
+
+def load(chat_id) -> bool:
+    """
+    Load the round of the chat from Postgres if Redis does not have it, return False when no round.
+    """
+    redis = get_redis_connection()
+    if redis.exists(state_keys(chat_id)[0]):
+        return True
+    game_round = Round.objects.filter(chat_id=chat_id).first()
+    if game_round is None:
+        return False
+    args = [STATE_EXPIRE, game_round.counter, game_round.round_counter, int(game_round.hide), game_round.message_id]
+    for actor_id, value, name in Actor.objects.filter(belong=game_round).values_list('id', 'value', 'name'):
+        args.extend((actor_id, value, name))
+    script(LOAD_SCRIPT)(keys=state_keys(chat_id), args=args)
+    return True
+
+
+def run(source: str, chat_id):
+    keys = state_keys(chat_id) + [DIRTY_KEY]
+    args = [STATE_EXPIRE, chat_id]
+    result = script(source)(keys=keys, args=args)
+    if result is None and load(chat_id):
+        result = script(source)(keys=keys, args=args)
+    return result
+
+
+def next_turn(chat_id) -> Optional[Tuple[int, int]]:
+    """
+    Move to the next actor, return the new counter and round counter, or None when no round.
+    """
+    result = run(NEXT_SCRIPT, chat_id)
+    if result is None:
+        return None
+    counter, round_counter = result
+    return counter, round_counter
+
+
+def prev_turn(chat_id) -> Optional[Tuple[int, int]]:
+    """
+    Move to the previous actor, the counter is `ALREADY_FIRST` if it's the first turn of the first round.
+    """
+    result = run(PREV_SCRIPT, chat_id)
+    if result is None:
+        return None
+    counter, round_counter = result
+    return counter, round_counter
+
+
+def remove_current(chat_id) -> Optional[int]:
+    """
+    Remove current actor, return 0 if it's the only actor, or None when no round.
+    """
+    result = run(REMOVE_CURRENT_SCRIPT, chat_id)
+    if result is None:
+        return None
+    actor_id = int(result)
+    if actor_id:
+        Actor.objects.filter(id=actor_id).delete()
+    return actor_id
+
+
+def add_actor(chat_id, name: str, value: int):
+    actor = Actor.objects.create(belong_id=chat_id, name=name, value=value)
+    redis = get_redis_connection()
+    state_key, actors_key, names_key = state_keys(chat_id)
+    if redis.exists(state_key):
+        pipeline = redis.pipeline()
+        pipeline.zadd(actors_key, {actor.id: value})
+        pipeline.hset(names_key, actor.id, name)
+        pipeline.execute()
+    return actor
+
+
+def set_field(chat_id, name: str, value):
+    """
+    Write a round field which already saved to Postgres, e.g. `hide` and `message_id`.
+    """
+    redis = get_redis_connection()
+    state_key = state_keys(chat_id)[0]
+    if redis.exists(state_key):
+        redis.hset(state_key, name, int(value))
+
+
+def get_state(chat_id) -> Optional[RoundState]:
+    if not load(chat_id):
+        return None
+    state_key, actors_key, names_key = state_keys(chat_id)
+    pipeline = get_redis_connection().pipeline()
+    pipeline.hgetall(state_key)
+    pipeline.zrevrange(actors_key, 0, -1, withscores=True)
+    pipeline.hgetall(names_key)
+    state, actors, names = pipeline.execute()
+    if not state:
+        return None
+    return RoundState(
+        chat_id=chat_id,
+        counter=int(state[b'counter']),
+        round_counter=int(state[b'round_counter']),
+        hide=state[b'hide'] == b'1',
+        message_id=int(state[b'message_id']),
+        actors=[(names.get(actor_id, b'').decode(), int(value)) for actor_id, value in actors],
+    )
+
+
+def discard(chat_id):
+    pipeline = get_redis_connection().pipeline()
+    pipeline.delete(*state_keys(chat_id))
+    pipeline.srem(DIRTY_KEY, chat_id)
+    pipeline.execute()
+
+
+def flush() -> int:
+    """
+    Write the counters of changed rounds back to Postgres, return the number of rounds written.
+    """
+    redis = get_redis_connection()
+    written = 0
+    while True:
+        chat_id_list = redis.spop(DIRTY_KEY, FLUSH_BATCH_SIZE)
+        if not chat_id_list:
+            return written
+        pipeline = redis.pipeline()
+        for chat_id in chat_id_list:
+            pipeline.hmget(state_keys(int(chat_id))[0], 'counter', 'round_counter')
+        for chat_id, (counter, round_counter) in zip(chat_id_list, pipeline.execute()):
+            if counter is None:
+                continue
+            Round.objects.filter(chat_id=int(chat_id)).update(counter=int(counter), round_counter=int(round_counter))
+            written += 1
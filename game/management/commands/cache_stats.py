@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from game.cache import stats, reset_stats
+
+
+class Command(BaseCommand):
+    help = 'Show hit ratio of the player and variable cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset counters after report')
+
+    def handle(self, *args, **options):
+        hit, miss = stats()
+        total = hit + miss
+        ratio = hit / total if total else 0.0
+        self.stdout.write('hit: {}, miss: {}, hit ratio: {:.2%}'.format(hit, miss, ratio))
+        if options['reset']:
+            reset_stats()
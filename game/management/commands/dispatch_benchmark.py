@@ -0,0 +1,43 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from bot import patterns
+from bot.bot import message_handlers, message_dispatcher
+
+
+def dispatch_sequential(text: str):
+    for pattern, handler in message_handlers:
+        result = patterns.split(pattern, text)
+        if result:
+            command, start = result
+            return handler, command, start
+    return None
+
+
+class Command(BaseCommand):
+    help = 'Replay a message corpus (one message per line) through the old and new command dispatchers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('corpus', type=str)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with open(options['corpus'], encoding='utf-8') as f:
+            corpus = [line.rstrip('\n') for line in f if line.strip()]
+        if not corpus:
+            self.stderr.write('Empty corpus')
+            return
+
+        mismatched = 0
+        for text in corpus:
+            if dispatch_sequential(text) != message_dispatcher.match(text):
+                mismatched += 1
+                self.stderr.write('Mismatched: {!r}'.format(text))
+
+        repeat = options['repeat']
+        for name, dispatch in (('sequential', dispatch_sequential), ('combined', message_dispatcher.match)):
+            elapsed = timeit.timeit(lambda: [dispatch(text) for text in corpus], number=repeat)
+            per_message = elapsed / (repeat * len(corpus)) * 1e6
+            self.stdout.write('{:>10}: {:.2f} µs/message'.format(name, per_message))
+        self.stdout.write('{} messages, {} mismatched'.format(len(corpus), mismatched))
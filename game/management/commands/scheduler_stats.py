@@ -0,0 +1,22 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from bot.scheduler import get_metrics
+
+
+class Command(BaseCommand):
+    help = 'Show queue depth and latency of each shard reported by the bot'
+
+    def handle(self, *args, **options):
+        metrics = get_metrics()
+        if not metrics:
+            self.stderr.write('No metrics reported yet')
+            return
+        reported = datetime.datetime.fromtimestamp(metrics['time'])
+        self.stdout.write('Reported at {}'.format(reported.strftime('%y-%m-%d %H:%M:%S')))
+        for shard in metrics['shards']:
+            self.stdout.write(
+                'shard {shard:>3}: depth {depth:>4}, processed {processed:>6}, deferred {deferred:>4}, '
+                'latency mean {mean_latency:.3f}s max {max_latency:.3f}s'.format(**{'deferred': 0, **shard})
+            )
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0008_auto_20190522_2146'),
+    ]
+
+    operations = [
+        # keep the earliest one of variables which names only differ in case
+        migrations.RunSQL(
+            '''
+            DELETE FROM game_variable a USING game_variable b
+            WHERE a.player_id = b.player_id AND UPPER(a.name) = UPPER(b.name) AND a.id > b.id;
+            ''',
+            migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            'CREATE UNIQUE INDEX game_variable_player_upper_name_uniq ON game_variable (player_id, UPPER(name));',
+            'DROP INDEX game_variable_player_upper_name_uniq;',
+        ),
+    ]
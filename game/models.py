@@ -1,4 +1,7 @@
-from django.db import models
+from django.db import models, connection
+from django.utils import timezone
+
+from .cache import bump_player_version, bump_variable_version
 
 
 class Round(models.Model):
@@ -29,10 +32,45 @@ class Player(models.Model):
     username = models.CharField(max_length=128, blank=True, default='')
     description = models.CharField(max_length=512, blank=True, default='')
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        bump_player_version(self.chat_id)
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        bump_player_version(self.chat_id)
+        return result
+
     def __str__(self):
         return '{} ({})'.format(self.character_name, self.full_name)
 
 
+class VariableManager(models.Manager):
+    def upsert(self, variables):
+        """
+        Insert variables, or update the value if the player already has a variable of the same name
+        (case insensitive, see the unique index in migration 0009).
+        """
+        if not variables:
+            return
+        now = timezone.now()
+        rows = []
+        params = []
+        for variable in variables:
+            variable.created = variable.updated = now
+            rows.append('(%s, %s, %s, %s, %s, %s)')
+            params.extend((variable.player_id, variable.name, variable.value, now, now, variable.group))
+        sql = (
+            'INSERT INTO game_variable (player_id, name, value, created, updated, "group") VALUES {} '
+            'ON CONFLICT (player_id, UPPER(name)) DO UPDATE SET value = EXCLUDED.value, updated = EXCLUDED.updated '
+            'RETURNING id'
+        ).format(', '.join(rows))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            for variable, (variable_id,) in zip(variables, cursor.fetchall()):
+                variable.id = variable_id
+
+
 class Variable(models.Model):
     player = models.ForeignKey(Player, models.CASCADE, null=False, blank=False, db_index=True)
     name = models.CharField(max_length=128, blank=False, null=False)
@@ -41,5 +79,16 @@ class Variable(models.Model):
     updated = models.DateTimeField(auto_now=True)
     group = models.CharField(max_length=32, default='', blank=True)
 
+    objects = VariableManager()
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        bump_variable_version(self.player_id)
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        bump_variable_version(self.player_id)
+        return result
+
     def __str__(self):
         return '{}: [{}]'.format(self.player.character_name, self.name)
@@ -0,0 +1,7 @@
+from game import initiative
+from play_trpg.celery import app
+
+
+@app.task
+def flush_initiative_task():
+    initiative.flush()
@@ -0,0 +1,78 @@
+"""
+DataLoaders of the GraphQL schema, which batch the lookups of a request into `IN` queries.
+
+Loaders cache the results, so they are created per request, see `get_loaders`.
+"""
+from collections import defaultdict
+
+from django.db.models import Count
+from promise import Promise
+from promise.dataloader import DataLoader
+
+from archive import models as archive
+from game import models as game
+
+
+def group_by(objects, key: str, keys) -> list:
+    groups = defaultdict(list)
+    for obj in objects:
+        groups[getattr(obj, key)].append(obj)
+    return [groups[k] for k in keys]
+
+
+class PlayersByChatLoader(DataLoader):
+    # key: telegram chat id
+    def batch_load_fn(self, keys):
+        players = game.Player.objects.filter(chat_id__in=keys)
+        return Promise.resolve(group_by(players, 'chat_id', keys))
+
+
+class PlayersByUserLoader(DataLoader):
+    # key: telegram user id
+    def batch_load_fn(self, keys):
+        players = game.Player.objects.filter(user_id__in=keys)
+        return Promise.resolve(group_by(players, 'user_id', keys))
+
+
+class LogCountLoader(DataLoader):
+    # key: chat id
+    def batch_load_fn(self, keys):
+        counts = archive.Log.objects.filter(chat_id__in=keys, deleted=False) \
+            .order_by().values('chat_id').annotate(count=Count('id'))
+        count_map = {row['chat_id']: row['count'] for row in counts}
+        return Promise.resolve([count_map.get(k, 0) for k in keys])
+
+
+class LogLoader(DataLoader):
+    # key: log id
+    def batch_load_fn(self, keys):
+        log_map = archive.Log.objects.in_bulk(keys)
+        return Promise.resolve([log_map.get(k) for k in keys])
+
+
+class TagsByLogLoader(DataLoader):
+    # key: log id
+    def batch_load_fn(self, keys):
+        log_tags = archive.Log.tag.through.objects.filter(log_id__in=keys).select_related('tag')
+        groups = defaultdict(list)
+        for log_tag in log_tags:
+            groups[log_tag.log_id].append(log_tag.tag)
+        return Promise.resolve([groups[k] for k in keys])
+
+
+class Loaders:
+    def __init__(self):
+        self.players_by_chat = PlayersByChatLoader()
+        self.players_by_user = PlayersByUserLoader()
+        self.log_count = LogCountLoader()
+        self.log = LogLoader()
+        self.tags_by_log = TagsByLogLoader()
+
+
+def get_loaders(info) -> Loaders:
+    request = info.context
+    loaders = getattr(request, 'loaders', None)
+    if loaders is None:
+        loaders = Loaders()
+        request.loaders = loaders
+    return loaders
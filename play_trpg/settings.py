@@ -65,6 +65,17 @@ if DEBUG:
 
 BOT_TOKEN = os.environ['BOT_TOKEN']
 
+# Point to a fake Telegram server in tests, default is https://api.telegram.org/bot
+TELEGRAM_BASE_URL = os.getenv('TELEGRAM_BASE_URL', None)
+
+# Receive updates by webhook instead of long polling when set, e.g. https://example.com/webhook
+BOT_WEBHOOK_URL = os.getenv('BOT_WEBHOOK_URL', '')
+BOT_WEBHOOK_LISTEN = os.getenv('BOT_WEBHOOK_LISTEN', '0.0.0.0')
+BOT_WEBHOOK_PORT = int(os.getenv('BOT_WEBHOOK_PORT', 8443))
+BOT_SHARDS = int(os.getenv('BOT_SHARDS', 8))
+BOT_UPDATE_QUEUE_SIZE = int(os.getenv('BOT_UPDATE_QUEUE_SIZE', 256))
+BOT_METRICS_INTERVAL = int(os.getenv('BOT_METRICS_INTERVAL', 60))
+
 LOGOUT_URL = '/logout'
 
 REDIS_HOST = os.getenv('REDIS_HOST', 'redis')
@@ -75,6 +86,16 @@ REDIS_URL = 'redis://{host}:{port}/{db}'.format(host=REDIS_HOST, port=REDIS_PORT
 CELERY_BROKER_URL = REDIS_URL
 CELERY_BACKEND_URL = REDIS_URL
 CELERY_IMPORTS = ['bot']
+CELERY_BEAT_SCHEDULE = {
+    'delete-due-messages': {
+        'task': 'bot.tasks.delete_due_messages_task',
+        'schedule': 1.0,
+    },
+    'flush-initiative': {
+        'task': 'game.tasks.flush_initiative_task',
+        'schedule': 5.0,
+    },
+}
 
 CACHES = {
     "default": {
@@ -199,6 +220,11 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'data/static/')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'data/media/')
 
+# Export files of the archive, not public since chats may have password
+EXPORT_ROOT = os.path.join(BASE_DIR, 'data/export/')
+# internal location of nginx which serves EXPORT_ROOT, serve files by Django if empty
+EXPORT_ACCEL_REDIRECT = os.getenv('EXPORT_ACCEL_REDIRECT', '')
+
 # Logging
 
 LOG_ROOT = os.path.join(BASE_DIR, 'data/log/')
@@ -268,7 +294,7 @@ LOGGING = {
     },
 }
 
-for path in [STATIC_ROOT, MEDIA_ROOT, LOG_ROOT]:
+for path in [STATIC_ROOT, MEDIA_ROOT, EXPORT_ROOT, LOG_ROOT]:
     if not os.path.exists(path):
         os.makedirs(path)
 
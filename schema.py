@@ -6,10 +6,14 @@ import graphene
 from graphene import NonNull
 from graphene_django import DjangoObjectType
 from django.core.cache import cache
+from django.db import transaction, IntegrityError
 from django.http import HttpRequest
 
 from archive import models as archive
+from archive.search import search_logs, split_keywords, highlight, SEARCH_LIMIT
 from game import models as game
+from game.cache import bump_variable_version
+from loaders import get_loaders
 from user import models as user
 
 Kind = graphene.Enum.from_enum(archive.LogKind)
@@ -29,10 +33,35 @@ class Tag(DjangoObjectType):
 class Log(DjangoObjectType):
     class Meta:
         model = archive.Log
-        exclude_fields = ('user_id', 'log_set', 'deleted')
+        exclude_fields = ('user_id', 'log_set', 'deleted', 'rendered_html', 'rendered_version')
 
     kind = Kind()
     entities = graphene.String(required=True)
+    rank = graphene.Float(description='Similarity to the search text, only in search results')
+    highlight = graphene.String(description='Rendered HTML with <mark> around keywords, only in search results')
+
+    @staticmethod
+    def resolve_reply(log: archive.Log, info):
+        if log.reply_id is None:
+            return None
+        if archive.Log.reply.is_cached(log):
+            return log.reply
+        return get_loaders(info).log.load(log.reply_id)
+
+    @staticmethod
+    def resolve_tag(log: archive.Log, info):
+        # `query_log` prefetched tags
+        if 'tag' in getattr(log, '_prefetched_objects_cache', {}):
+            return log.tag.all()
+        return get_loaders(info).tags_by_log.load(log.id)
+
+    @staticmethod
+    def resolve_rank(log: archive.Log, info):
+        return getattr(log, 'rank', None)
+
+    @staticmethod
+    def resolve_highlight(log: archive.Log, info):
+        return getattr(log, 'highlighted_html', None)
 
 
 class Player(DjangoObjectType):
@@ -71,12 +100,20 @@ class VariableMutation(graphene.Mutation):
                 variable.value = value
             if group:
                 variable.group = group
-            variable.save()
+            try:
+                with transaction.atomic():
+                    variable.save()
+            except IntegrityError:
+                # names are unique case insensitively, see migration 0009
+                return VariableMutation(variable=None, error='Variable name already exists.')
         else:
             if not name:
                 return VariableMutation(variable=None, error='Create variable needs name.')
             variable = game.Variable(player=my_player, name=name, value=value, group=group)
-            variable.save()
+            # update the value if the name already exists
+            game.Variable.objects.upsert([variable])
+            bump_variable_version(my_player.id)
+            variable.refresh_from_db()
         return VariableMutation(variable=variable)
 
 
@@ -86,6 +123,8 @@ class Chat(DjangoObjectType):
         exclude_fields = ('password', 'parent')
 
     log_list = graphene.Field(graphene.List(NonNull(Log), required=True), password=graphene.String())
+    search = graphene.Field(graphene.List(NonNull(Log), required=True),
+                            text=graphene.String(required=True), password=graphene.String())
     is_require_password = graphene.Boolean(required=True)
     counter = graphene.Int(required=True)
     page_counter = graphene.Int(required=True)
@@ -93,7 +132,7 @@ class Chat(DjangoObjectType):
 
     @staticmethod
     def resolve_players(chat: archive.Chat, info):
-        return game.Player.objects.filter(chat_id=chat.chat_id).all()
+        return get_loaders(info).players_by_chat.load(chat.chat_id)
 
     @staticmethod
     def resolve_is_require_password(chat: archive.Chat, info):
@@ -117,9 +156,19 @@ class Chat(DjangoObjectType):
         cache.set(log_list_cache_time_key, datetime.datetime.now())
         return log_list
 
+    @staticmethod
+    def resolve_search(chat: archive.Chat, info, text: str, password=''):
+        if not chat.validate(password):
+            return None
+        log_list = list(search_logs(chat.query_log(), text)[:SEARCH_LIMIT])
+        keywords = split_keywords(text)
+        for log in log_list:
+            log.highlighted_html = highlight(log.entities_html(), keywords)
+        return log_list
+
     @staticmethod
     def resolve_counter(chat: archive.Chat, info):
-        return chat.log_count()
+        return get_loaders(info).log_count.load(chat.id)
 
 
 class TelegramProfile(DjangoObjectType):
@@ -127,7 +176,7 @@ class TelegramProfile(DjangoObjectType):
 
     @staticmethod
     def resolve_player_set(profile: user.TelegramProfile, info):
-        return game.Player.objects.filter(user_id=profile.telegram_id).all()
+        return get_loaders(info).players_by_user.load(profile.telegram_id)
 
     class Meta:
         model = user.TelegramProfile